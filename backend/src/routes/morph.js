@@ -61,6 +61,28 @@ router.post('/detect-faces', async (req, res, next) => {
   }
 });
 
+/**
+ * GET /api/morph/keyframes/:batchId/:file
+ * Proxies keyframe thumbnails returned by /detect-faces as imageUrl.
+ */
+router.get('/keyframes/:batchId/:file', async (req, res, next) => {
+  const { batchId, file } = req.params;
+  if (!/^[0-9a-f]+$/.test(batchId) || !/^\d+\.jpg$/.test(file)) {
+    return res.status(400).json({ error: 'Invalid keyframe path' });
+  }
+  try {
+    const response = await fetch(`${MORPH_SERVICE_URL}/keyframes/${batchId}/${file}`);
+    if (!response.ok) {
+      return res.status(response.status).json({ error: 'Keyframe not found' });
+    }
+    res.set('Content-Type', 'image/jpeg');
+    res.set('Cache-Control', 'private, max-age=3600');
+    res.send(Buffer.from(await response.arrayBuffer()));
+  } catch (err) {
+    next(err);
+  }
+});
+
 /**
  * POST /api/morph/run
  * Body: { photoId, videoId, faceTrackId, targetEmbedding, jobId }
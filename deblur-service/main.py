@@ -9,6 +9,10 @@ import base64
 import tempfile
 import subprocess
 import uuid
+import queue
+import functools
+import threading
+import time
 import traceback
 from pathlib import Path
 import logging
@@ -49,27 +53,208 @@ def update_job_progress(job_id: str, progress: float, status: str = "processing"
     _jobs[job_id] = {
         "progress": round(progress, 2),
         "status": status,
-        "result": result,
-        "updated_at": os.times()[4] if hasattr(os, 'times') else 0
+        "result": result
     }
 
+# TensorRT engines are cached here, keyed by precision and input shape bucket
+TRT_ENGINE_DIR = Path(os.environ.get("DEBLUR_TRT_ENGINE_DIR", str(Path(__file__).parent / "trt_engines")))
+USE_TENSORRT = os.environ.get("DEBLUR_TENSORRT", "1").strip() == "1"
+# NHWC lets cuDNN pick channels-last conv kernels; set to 0 to benchmark against NCHW
+USE_CHANNELS_LAST = os.environ.get("DEBLUR_CHANNELS_LAST", "1").strip() == "1"
+# Opt-in: torch.compile the RRDBNet when TensorRT isn't handling inference (PyTorch 2+, CUDA only).
+# Off by default: there is no warm-up yet, so the first batch of a job pays the compile
+USE_TORCH_COMPILE = os.environ.get("DEBLUR_TORCH_COMPILE", "0").strip() == "1"
+# Frames buffered between the decode, enhance and encode stages
+PIPELINE_QUEUE_SIZE = 64
+# Upper bound on a request's batch_size; each batch frame is also a pinned output slot
+MAX_BATCH_SIZE = 16
+# Mean absolute pixel difference below which a frame counts as a repeat of the last enhanced one ("fast" mode)
+STATIC_FRAME_THRESHOLD = 0.5
+# Minimum seconds between progress reports while frames are being enhanced
+PROGRESS_INTERVAL = 1.0
+
+class _TensorRTModel:
+    """Drop-in replacement for the RRDBNet forward that runs a cached TensorRT engine.
+    
+    Engines are built from an ONNX export of the PyTorch model the first time an
+    input shape bucket is seen and serialized to TRT_ENGINE_DIR. Any TensorRT
+    failure permanently falls back to the wrapped PyTorch module.
+    """
+    SHAPE_BUCKET = 256  # Round max H/W up so nearby resolutions share one engine
+    
+    def __init__(self, module, precision, model_name="RealESRGAN_x4plus"):
+        import tensorrt as trt  # Raises ImportError when TensorRT isn't installed
+        self.trt = trt
+        self.module = module
+        self.precision = precision
+        self.model_name = model_name
+        self.trt_logger = trt.Logger(trt.Logger.WARNING)
+        self.engine = None
+        self.context = None
+        self.max_shape = None
+        self.failed = False
+    
+    def parameters(self):
+        return self.module.parameters()
+    
+    def _engine_path(self, max_shape):
+        b, _, h, w = max_shape
+        return TRT_ENGINE_DIR / f"{self.model_name}_{self.precision}_b{b}_{h}x{w}_trt{self.trt.__version__}.engine"
+    
+    def _build_engine(self, max_shape, engine_path):
+        import torch
+        trt = self.trt
+        
+        TRT_ENGINE_DIR.mkdir(parents=True, exist_ok=True)
+        onnx_path = engine_path.with_suffix(".onnx")
+        logger.info(f"Exporting {self.model_name} to ONNX for TensorRT: {onnx_path}")
+        dummy = torch.zeros((1, 3, 64, 64), dtype=next(self.module.parameters()).dtype, device='cuda')
+        torch.onnx.export(
+            self.module, dummy, str(onnx_path),
+            input_names=["input"], output_names=["output"], opset_version=17,
+            dynamic_axes={"input": {0: "b", 2: "h", 3: "w"}, "output": {0: "b", 2: "h", 3: "w"}}
+        )
+        
+        logger.info(f"Building TensorRT engine for max input {max_shape} (one-time, may take minutes)...")
+        builder = trt.Builder(self.trt_logger)
+        network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+        parser = trt.OnnxParser(network, self.trt_logger)
+        if not parser.parse(onnx_path.read_bytes()):
+            raise RuntimeError(f"TensorRT ONNX parse failed: {parser.get_error(0)}")
+        config = builder.create_builder_config()
+        if self.precision == "fp16":
+            config.set_flag(trt.BuilderFlag.FP16)
+        profile = builder.create_optimization_profile()
+        b, c, h, w = max_shape
+        profile.set_shape("input", (1, c, 16, 16), max_shape, max_shape)
+        config.add_optimization_profile(profile)
+        serialized = builder.build_serialized_network(network, config)
+        if serialized is None:
+            raise RuntimeError("TensorRT engine build failed")
+        engine_path.write_bytes(bytes(serialized))
+        onnx_path.unlink(missing_ok=True)
+        logger.info(f"TensorRT engine saved to {engine_path}")
+    
+    def _load_engine(self, shape):
+        b, c, h, w = shape
+        bucket = self.SHAPE_BUCKET
+        max_shape = (b, c, -(-h // bucket) * bucket, -(-w // bucket) * bucket)
+        engine_path = self._engine_path(max_shape)
+        if not engine_path.exists():
+            self._build_engine(max_shape, engine_path)
+        runtime = self.trt.Runtime(self.trt_logger)
+        self.engine = runtime.deserialize_cuda_engine(engine_path.read_bytes())
+        self.context = self.engine.create_execution_context()
+        self.max_shape = max_shape
+    
+    def _fits(self, shape):
+        return self.max_shape is not None and all(s <= m for s, m in zip(shape, self.max_shape))
+    
+    def __call__(self, x):
+        if self.failed:
+            return self.module(x)
+        try:
+            import torch
+            
+            if not self._fits(x.shape):
+                self._load_engine(tuple(x.shape))
+            x = x.contiguous()
+            self.context.set_input_shape("input", tuple(x.shape))
+            out = torch.empty(tuple(self.context.get_tensor_shape("output")), dtype=x.dtype, device=x.device)
+            self.context.set_tensor_address("input", x.data_ptr())
+            self.context.set_tensor_address("output", out.data_ptr())
+            if not self.context.execute_async_v3(torch.cuda.current_stream().cuda_stream):
+                raise RuntimeError("TensorRT execution failed")
+            return out
+        except Exception as e:
+            logger.error(f"TensorRT inference failed, falling back to PyTorch: {e}")
+            self.failed = True
+            return self.module(x)
+
+# (tile, tile_pad) per quality mode. Tiling bounds GPU memory on large frames;
+# "best" runs the whole frame in one pass.
+TILE_SETTINGS = {
+    "fast": (256, 32),
+    "balanced": (512, 32),
+    "best": (0, 10),
+}
+
+def _use_local_padding(module):
+    """Switch zero-padded convs to replicate padding.
+    
+    With zero padding every tile border looks like an image edge, which leaves
+    seams when tiles are stitched; replicate padding keeps tile outputs consistent
+    with their neighbours so only a small tile_pad overlap is needed.
+    """
+    import torch
+    for m in module.modules():
+        if isinstance(m, torch.nn.Conv2d) and m.padding_mode == 'zeros' and any(p > 0 for p in m.padding):
+            m.padding_mode = 'replicate'
+
 # Lazy loading for Real-ESRGAN AI model
 _realesrgan_model = None
+_realesrgan_precision = None
+
+def _resolve_precision(precision, device):
+    """Map a requested precision to one the device can run ("fp32", "fp16" or "bf16")"""
+    import torch
+    
+    if device.type != 'cuda':
+        # Half precision on CPU is slower than fp32 and not supported by every op
+        return "fp32"
+    if precision == "bf16":
+        # BF16 tensor cores need Ampere (compute capability 8.0) or newer
+        major, _ = torch.cuda.get_device_capability(device)
+        if major < 8:
+            logger.info("BF16 not supported on this GPU, using FP16")
+            return "fp16"
+    if precision not in ("fp32", "fp16", "bf16"):
+        return "fp16"
+    return precision
+
+def _compile_model(module):
+    """Wrap the RRDBNet in torch.compile so Inductor fuses its conv + LeakyReLU chains"""
+    import torch
+    
+    if not hasattr(torch, "compile"):
+        return module
+    try:
+        import torch._dynamo
+        # Run eagerly instead of failing the job when Inductor can't build (e.g. no Triton on Windows)
+        torch._dynamo.config.suppress_errors = True
+        # Tile edges, partial last batches and fast-mode flushes all change the input shape.
+        # dynamic=True compiles one shape-generic graph instead of one per shape, and the default
+        # mode skips max-autotune's per-shape kernel benchmarking of all 23 RRDB blocks
+        compiled = torch.compile(module, mode="default", dynamic=True)
+        logger.info("RRDBNet compiled with torch.compile; the first batch includes compile time")
+        return compiled
+    except Exception as e:
+        logger.warning(f"torch.compile unavailable, using eager PyTorch: {e}")
+        return module
 
-def get_ai_enhancer():
+def get_ai_enhancer(precision="fp16"):
     """Lazy load Real-ESRGAN model for AI enhancement"""
-    global _realesrgan_model
+    global _realesrgan_model, _realesrgan_precision
+    try:
+        import torch
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        precision = _resolve_precision(precision, device)
+    except ImportError as e:
+        logger.warning(f"PyTorch not available: {e}. Falling back to FFmpeg unsharp")
+        return None
+    
+    if _realesrgan_model is not None and _realesrgan_precision != precision:
+        # Reload so weights are cast from the original fp32 checkpoint
+        logger.info(f"Precision changed to {precision}, reloading Real-ESRGAN model")
+        _realesrgan_model = None
+    
     if _realesrgan_model is None:
         try:
             from realesrgan import RealESRGANer
             from basicsr.archs.rrdbnet_arch import RRDBNet
-            import torch
             
             logger.info("Loading Real-ESRGAN AI model...")
-            
-            # Determine device (CUDA or CPU)
-            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-            logger.info(f"Using device: {device}")
+            logger.info(f"Using device: {device}, precision: {precision}")
             
             # Initialize RRDBNet model (x4 upscaling)
             model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
@@ -79,14 +264,33 @@ def get_ai_enhancer():
                 scale=4,
                 model_path='https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth',
                 model=model,
-                tile=0,  # No tiling for better quality
+                tile=0,  # Set per request from TILE_SETTINGS
                 tile_pad=10,
                 pre_pad=0,
-                half=device.type == 'cuda',  # Use FP16 on GPU for speed
+                half=precision == "fp16",  # Use FP16 on GPU for speed
                 device=device
             )
+            _use_local_padding(upsampler.model)
+            if device.type == 'cuda' and USE_CHANNELS_LAST:
+                upsampler.model = upsampler.model.to(memory_format=torch.channels_last)
+            if precision == "bf16":
+                # Same bandwidth savings as FP16 without its overflow risk
+                upsampler.model = upsampler.model.bfloat16()
+            elif device.type == 'cuda' and USE_TENSORRT:
+                try:
+                    upsampler.model = _TensorRTModel(upsampler.model, precision)
+                    logger.info("TensorRT available, RRDBNet will run through a cached engine")
+                except ImportError:
+                    logger.info("TensorRT not installed, using PyTorch inference")
+            if device.type == 'cuda' and USE_TORCH_COMPILE and not isinstance(upsampler.model, _TensorRTModel):
+                upsampler.model = _compile_model(upsampler.model)
             
+            if device.type == 'cuda' and _cuda_stream is not None:
+                # A reload queues its weight casts on the default stream; the enhancement
+                # stream already exists, so order it after them explicitly
+                _cuda_stream.wait_stream(torch.cuda.current_stream())
             _realesrgan_model = upsampler
+            _realesrgan_precision = precision
             logger.info("Real-ESRGAN model loaded successfully")
             return upsampler
             
@@ -98,36 +302,122 @@ def get_ai_enhancer():
             return None
     return _realesrgan_model
 
-def enhance_frame_with_ai(frame, model, quality_mode="balanced"):
-    """Enhance a single frame using Real-ESRGAN AI"""
+_cuda_stream = None
+# Serializes use of the process-wide RealESRGANer, whose per-call state is stored on the object
+_enhance_lock = threading.Lock()
+
+def _get_cuda_stream():
+    """Dedicated stream for enhancement so its copies and kernels don't serialize on the default stream"""
+    global _cuda_stream
+    if _cuda_stream is None:
+        import torch
+        _cuda_stream = torch.cuda.Stream()
+        # Weight casts/layout changes were queued on the default stream at load time;
+        # later reloads re-sync in get_ai_enhancer
+        _cuda_stream.wait_stream(torch.cuda.current_stream())
+    return _cuda_stream
+
+def enhance_frames_with_ai(frames, model, quality_mode="balanced", out=None):
+    """Enhance a batch of equal-shape RGB frames with one Real-ESRGAN forward pass.
+    
+    On CUDA, ``out`` may supply one preallocated (pinned) uint8 array per frame to
+    receive the results instead of allocating fresh host memory each batch.
+    """
     try:
         if model is None:
             # Fallback to simple sharpening if model not available
-            return apply_unsharp_fallback(frame)
-        
-        # Convert BGR to RGB for Real-ESRGAN
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # Real-ESRGAN enhancement
-        # Returns (output, _) where output is the enhanced image
-        enhanced, _ = model.enhance(rgb_frame, outscale=1.0)  # outscale=1 keeps original size
+            return [apply_unsharp_fallback(frame) for frame in frames]
         
-        # Convert back to BGR for OpenCV
-        enhanced_bgr = cv2.cvtColor(enhanced, cv2.COLOR_RGB2BGR)
+        assert all(f.shape == frames[0].shape for f in frames), "Batched frames must share one shape"
+        import torch
         
-        # Resize back to original size if needed
-        if enhanced_bgr.shape[:2] != frame.shape[:2]:
-            enhanced_bgr = cv2.resize(enhanced_bgr, (frame.shape[1], frame.shape[0]), interpolation=cv2.INTER_LANCZOS4)
+        h, w = frames[0].shape[:2]
+        on_cuda = model.device.type == 'cuda'
+        # torch.cuda.stream(None) is a no-op, so the CPU path runs unchanged
+        with torch.no_grad(), torch.cuda.stream(_get_cuda_stream() if on_cuda else None):
+            # Stack RGB uint8 frames into one NCHW batch in [0, 1]
+            if on_cuda:
+                # Stack straight into page-locked memory so the upload is a single async DMA
+                host = torch.empty((len(frames), h, w, 3), dtype=torch.uint8, pin_memory=True)
+                np.stack(frames, out=host.numpy())
+                batch = host.to(model.device, non_blocking=True)
+            else:
+                batch = torch.from_numpy(np.stack(frames))
+            batch = batch.permute(0, 3, 1, 2).float().div_(255.0)
+            # Match the weights' dtype (fp32, fp16 or bf16)
+            batch = batch.to(next(model.model.parameters()).dtype)
+            if USE_CHANNELS_LAST:
+                # NHWC frames permuted to NCHW are already channels-last, so this is free
+                batch = batch.contiguous(memory_format=torch.channels_last)
+            
+            # Drive RealESRGANer's forward (and tiling) directly; its enhance() is single-image only.
+            # tile_size/img/output live on the shared upsampler, so concurrent jobs take turns
+            with _enhance_lock:
+                model.tile_size, model.tile_pad = TILE_SETTINGS.get(quality_mode, TILE_SETTINGS["balanced"])
+                model.img = batch
+                if model.tile_size > 0:
+                    model.tile_process()
+                else:
+                    model.process()
+                output = model.output.data
+            
+            # Downscale back to the input size (the model upscales x4) and quantize on
+            # the GPU so only uint8 pixels at the original resolution cross PCIe
+            if tuple(output.shape[2:]) != (h, w):
+                output = torch.nn.functional.interpolate(output.float(), size=(h, w), mode='bicubic', antialias=True)
+            output = output.clamp(0, 1).mul_(255.0).round_().to(torch.uint8)
+            
+            # Back to RGB NHWC for the encoder; made contiguous on the GPU (a no-op for
+            # channels-last output) so the host copy needs no extra reshuffle
+            output = output.permute(0, 2, 3, 1).contiguous()
+            if on_cuda:
+                if out is None:
+                    out = list(torch.empty(output.shape, dtype=torch.uint8, pin_memory=True).numpy())
+                for dst, src in zip(out, output):
+                    torch.from_numpy(dst).copy_(src, non_blocking=True)
+                # The only sync point per batch
+                torch.cuda.current_stream().synchronize()
+                output = out[:len(frames)]
+            else:
+                output = output.numpy()
         
-        return enhanced_bgr
+        return list(output)
     except Exception as e:
         logger.error(f"AI enhancement failed: {e}")
         logger.exception("Detailed error:")
         # Fallback to unsharp
-        return apply_unsharp_fallback(frame)
+        return [apply_unsharp_fallback(frame) for frame in frames]
+
+_cuda_gaussian = None
+
+def _get_cuda_gaussian():
+    """Lazily build the OpenCV CUDA Gaussian filter; None when OpenCV has no CUDA device"""
+    global _cuda_gaussian
+    if _cuda_gaussian is None:
+        try:
+            if cv2.cuda.getCudaEnabledDeviceCount() > 0:
+                # NPP filters take 1 or 4 channel images, so frames are padded to RGBA on the GPU
+                _cuda_gaussian = cv2.cuda.createGaussianFilter(cv2.CV_8UC4, cv2.CV_8UC4, (5, 5), 0)
+            else:
+                _cuda_gaussian = False
+        except Exception as e:
+            logger.info(f"OpenCV CUDA unavailable, unsharp fallback stays on CPU: {e}")
+            _cuda_gaussian = False
+    return _cuda_gaussian or None
 
 def apply_unsharp_fallback(frame, strength=1.5):
     """Fallback sharpening using OpenCV unsharp mask"""
+    gaussian_filter = _get_cuda_gaussian()
+    if gaussian_filter is not None:
+        try:
+            gpu_frame = cv2.cuda_GpuMat()
+            gpu_frame.upload(frame)
+            gpu_frame = cv2.cuda.cvtColor(gpu_frame, cv2.COLOR_RGB2RGBA)
+            gaussian = gaussian_filter.apply(gpu_frame)
+            unsharp = cv2.cuda.addWeighted(gpu_frame, 1.0 + strength, gaussian, -strength, 0)
+            return cv2.cuda.cvtColor(unsharp, cv2.COLOR_RGBA2RGB).download()
+        except Exception as e:
+            logger.warning(f"CUDA unsharp failed, using CPU: {e}")
     try:
         # Create unsharp mask kernel
         gaussian = cv2.GaussianBlur(frame, (5, 5), 0)
@@ -142,6 +432,9 @@ class EnhanceRequest(BaseModel):
     job_id: str | None = None
     use_cuda: bool = True
     quality_mode: str = "balanced"  # "fast", "balanced", "best"
+    batch_size: int = 4  # Frames per Real-ESRGAN forward pass (clamped to 1..MAX_BATCH_SIZE)
+    precision: str = "fp16"  # "fp32", "fp16", "bf16" (GPU only; CPU always runs fp32)
+    backend: str = "realesrgan"  # "realesrgan", "ffmpeg"
 
 @app.get("/health")
 def health():
@@ -163,8 +456,147 @@ def enhance(background_tasks: BackgroundTasks, req: EnhanceRequest = Body(...)):
     background_tasks.add_task(_do_enhance, job_id, req)
     return {"jobId": job_id, "status": "queued"}
 
+def _alloc_output_ring(count, height, width, device):
+    """Page-locked frame buffers for enhance_frames_with_ai to download into (CUDA only)"""
+    if device.type != 'cuda':
+        return None
+    import torch
+    ring = torch.empty((count, height, width, 3), dtype=torch.uint8, pin_memory=True).numpy()
+    return list(ring)
+
+def _open_ffmpeg_decoder(video_path):
+    """Start an FFmpeg process that decodes the video to raw RGB frames on stdout"""
+    return subprocess.Popen([
+        "ffmpeg", "-loglevel", "error",
+        "-i", str(video_path),
+        "-f", "rawvideo",
+        "-pix_fmt", "rgb24",
+        "pipe:1"
+    ], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+def _read_raw_frame(decoder, width, height):
+    """Read one (height, width, 3) uint8 frame from a rawvideo decoder; None at EOF"""
+    frame_bytes = width * height * 3
+    buf = decoder.stdout.read(frame_bytes)
+    if len(buf) < frame_bytes:
+        return None
+    return np.frombuffer(buf, dtype=np.uint8).reshape(height, width, 3)
+
+def _queue_put(q, item, stop):
+    """Put into a bounded queue, giving up once `stop` is set so a producer never
+    blocks forever on a consumer that has died"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _queue_get(q, stop):
+    """Get from a queue, returning None (the end-of-stream sentinel) once `stop` is set"""
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return None
+
+def _decode_worker(decoder, width, height, frame_queue, stop, errors):
+    """Pipeline stage: read raw frames from FFmpeg into frame_queue, then a None sentinel"""
+    try:
+        while not stop.is_set():
+            frame = _read_raw_frame(decoder, width, height)
+            if frame is None:
+                break
+            if not _queue_put(frame_queue, frame, stop):
+                break
+    except Exception as e:
+        errors.append(e)
+    finally:
+        _queue_put(frame_queue, None, stop)
+
+def _encode_worker(encoder, output_queue, stop, errors):
+    """Pipeline stage: write enhanced frames from output_queue to the FFmpeg encoder"""
+    try:
+        while True:
+            frame = _queue_get(output_queue, stop)
+            if frame is None:
+                break
+            encoder.stdin.write(np.ascontiguousarray(frame).data)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+
+@functools.lru_cache(maxsize=1)
+def _nvenc_available():
+    """Whether h264_nvenc can actually encode here (probed once with a one-frame test encode)
+    
+    Listing the encoder in `ffmpeg -encoders` only means FFmpeg was built with it; the
+    driver or a free NVENC session may still be missing, and frames already piped into a
+    failed encoder can't be replayed into a libx264 fallback.
+    """
+    try:
+        result = subprocess.run([
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", "color=c=black:s=256x256:r=1", "-frames:v", "1",
+            "-c:v", "h264_nvenc", "-f", "null", "-"
+        ], capture_output=True, timeout=20)
+        return result.returncode == 0
+    except Exception:
+        return False
+
+def _video_codec_args(quality_mode, use_nvenc):
+    """FFmpeg video codec arguments for a quality mode, on NVENC or libx264"""
+    if use_nvenc:
+        # Encoding runs on the GPU's NVENC block and leaves the CPU free
+        presets = {"best": ("p7", "18"), "fast": ("p3", "28")}
+        preset, cq = presets.get(quality_mode, ("p5", "23"))
+        return ["-c:v", "h264_nvenc", "-preset", preset, "-tune", "hq", "-rc", "vbr", "-cq", cq, "-b:v", "0"]
+    presets = {"best": ("slow", "18"), "fast": ("veryfast", "28")}
+    preset, crf = presets.get(quality_mode, ("fast", "23"))
+    return ["-c:v", "libx264", "-preset", preset, "-crf", crf]
+
+def _open_ffmpeg_encoder(output_path, video_path, width, height, fps, video_codec_args):
+    """Start an FFmpeg process that encodes raw RGB frames written to its stdin.
+    
+    Audio is muxed from the original video. FFmpeg's log goes to a file next to the
+    output so a long encode can't fill (and block on) an unread stderr pipe.
+    """
+    log_file = open(Path(output_path).with_suffix(".ffmpeg.log"), "wb")
+    try:
+        return subprocess.Popen([
+            "ffmpeg", "-y",
+            "-f", "rawvideo",
+            "-pix_fmt", "rgb24",
+            "-s", f"{width}x{height}",
+            "-framerate", str(fps),
+            "-i", "pipe:0",
+            "-i", str(video_path),
+            "-map", "0:v",
+            "-map", "1:a?",
+            *video_codec_args,
+            "-pix_fmt", "yuv420p",
+            "-c:a", "aac",
+            "-shortest",
+            str(output_path)
+        ], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log_file)
+    finally:
+        # The child holds its own handle
+        log_file.close()
+
+def _close_ffmpeg_encoder(encoder):
+    """Close the encoder's stdin, wait for it to finish and raise if it failed"""
+    encoder.stdin.close()
+    returncode = encoder.wait()
+    if returncode != 0:
+        raise RuntimeError(f"FFmpeg encoding failed with exit code {returncode} (see {Path(encoder.args[-1]).with_suffix('.ffmpeg.log')})")
+
 def _do_enhance(job_id: str, req: EnhanceRequest):
     frames_dir = None
+    decoder = None
+    encoder = None
+    stop = None
     try:
         # Ensure job is initialized immediately
         update_job_progress(job_id, 0, "starting")
@@ -174,11 +606,19 @@ def _do_enhance(job_id: str, req: EnhanceRequest):
             update_job_progress(job_id, 0, "error", {"error": "Video file not found"})
             return
         
-        logger.info(f"Starting enhancement for {video_path} (quality: {req.quality_mode})")
+        if req.backend not in ("realesrgan", "ffmpeg"):
+            update_job_progress(job_id, 0, "error", {"error": f"Unknown backend: {req.backend}"})
+            return
+        
+        logger.info(f"Starting enhancement for {video_path} (quality: {req.quality_mode}, backend: {req.backend})")
+        if req.backend == "ffmpeg":
+            _do_ffmpeg_enhance(job_id, req)
+            return
+        
         update_job_progress(job_id, 5, "loading_model")
         
         # Load AI model
-        model = get_ai_enhancer()
+        model = get_ai_enhancer(req.precision)
         if model is None:
             logger.warning("Real-ESRGAN not available, using FFmpeg unsharp filter")
             # Fallback to FFmpeg-based enhancement
@@ -187,7 +627,7 @@ def _do_enhance(job_id: str, req: EnhanceRequest):
         
         update_job_progress(job_id, 10, "reading_video")
         
-        # Open video
+        # Probe video metadata
         cap = cv2.VideoCapture(str(video_path))
         if not cap.isOpened():
             update_job_progress(job_id, 0, "error", {"error": "Failed to open video"})
@@ -197,85 +637,117 @@ def _do_enhance(job_id: str, req: EnhanceRequest):
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # With auto-orientation OpenCV already reports the rotated size FFmpeg decodes to
+        cap.release()
+        
+        # Decode with FFmpeg straight to RGB, the layout Real-ESRGAN expects
+        decoder = _open_ffmpeg_decoder(video_path)
         
         logger.info(f"Video: {width}x{height} @ {fps}fps, {total_frames} frames")
         
-        # Create temporary directory for frames
+        # Create temporary directory for the encoded output
         frames_dir = Path(tempfile.mkdtemp(prefix="deblur_"))
         logger.info(f"Using temp directory: {frames_dir}")
+        output_path = frames_dir / "enhanced_output.mp4"
+        
+        # Determine encoding settings based on quality mode; use NVENC when the model runs on CUDA
+        use_nvenc = model.device.type == 'cuda' and _nvenc_available()
+        video_codec_args = _video_codec_args(req.quality_mode, use_nvenc)
         
         update_job_progress(job_id, 15, "processing_frames")
         
-        # Process frames
+        logger.info(f"Encoding video with {' '.join(video_codec_args)}")
+        encoder = _open_ffmpeg_encoder(output_path, video_path, width, height, fps, video_codec_args)
+        
+        # Decode, enhance and encode run concurrently: a decoder thread prefetches frames,
+        # this thread batches them through the model, and a writer thread feeds FFmpeg.
+        # Enhanced frames are piped straight into FFmpeg instead of round-tripping through PNGs.
+        frame_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        output_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        stop = threading.Event()
+        errors = []
+        workers = [
+            threading.Thread(target=_decode_worker, args=(decoder, width, height, frame_queue, stop, errors), daemon=True),
+            threading.Thread(target=_encode_worker, args=(encoder, output_queue, stop, errors), daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+        
+        batch_size = max(1, min(req.batch_size, MAX_BATCH_SIZE))
+        skip_static = req.quality_mode == "fast"
+        # Reusable pinned output frames, handed out round-robin. A slot is only rewritten
+        # once every frame queued after it has gone through the writer: the queue, the
+        # writer's frame in hand, the batch being filled and the repeated static frame.
+        out_ring = _alloc_output_ring(PIPELINE_QUEUE_SIZE + batch_size + 3, height, width, model.device)
+        ring_pos = 0
         frame_idx = 0
-        enhanced_frames = []
+        batch = []
+        # One entry per decoded frame: index into batch, or -1 to repeat the previous batch's last output
+        slots = []
+        ref_frame = None
+        prev_enhanced = None
+        last_update = time.monotonic()
         
         while True:
-            ret, frame = cap.read()
-            if not ret:
+            frame = _queue_get(frame_queue, stop)
+            if frame is not None:
+                # Near-duplicate of the last frame sent to the model: reuse its output instead of a forward pass
+                if skip_static and ref_frame is not None and cv2.absdiff(frame, ref_frame).mean() < STATIC_FRAME_THRESHOLD:
+                    slots.append(len(batch) - 1)
+                else:
+                    batch.append(frame)
+                    slots.append(len(batch) - 1)
+                    ref_frame = frame
+            if slots and (frame is None or len(batch) == batch_size or len(slots) >= PIPELINE_QUEUE_SIZE):
+                # Enhance batch
+                out = None
+                if out_ring:
+                    out = [out_ring[(ring_pos + i) % len(out_ring)] for i in range(len(batch))]
+                    ring_pos = (ring_pos + len(batch)) % len(out_ring)
+                enhanced = enhance_frames_with_ai(batch, model, req.quality_mode, out) if batch else []
+                for slot in slots:
+                    enhanced_frame = enhanced[slot] if slot >= 0 else prev_enhanced
+                    # Hand frame to the writer thread
+                    if not _queue_put(output_queue, enhanced_frame, stop):
+                        raise errors[0] if errors else RuntimeError("Encoder stopped")
+                    
+                    frame_idx += 1
+                    
+                    # Update progress at most once per PROGRESS_INTERVAL, plus the last frame
+                    now = time.monotonic()
+                    if now - last_update >= PROGRESS_INTERVAL or frame_idx == total_frames:
+                        last_update = now
+                        progress = 15 + int((frame_idx / total_frames) * 75)
+                        update_job_progress(job_id, progress, "processing_frames", {
+                            "frames_processed": frame_idx,
+                            "total_frames": total_frames
+                        })
+                        logger.info(f"Processed {frame_idx}/{total_frames} frames")
+                if enhanced:
+                    prev_enhanced = enhanced[-1]
+                batch.clear()
+                slots.clear()
+            if frame is None:
                 break
-            
-            # Enhance frame
-            enhanced_frame = enhance_frame_with_ai(frame, model, req.quality_mode)
-            enhanced_frames.append(enhanced_frame)
-            
-            # Save frame
-            frame_path = frames_dir / f"frame_{frame_idx:08d}.png"
-            cv2.imwrite(str(frame_path), enhanced_frame)
-            
-            frame_idx += 1
-            
-            # Update progress
-            if frame_idx % 10 == 0 or frame_idx == total_frames:
-                progress = 15 + int((frame_idx / total_frames) * 75)
-                update_job_progress(job_id, progress, "processing_frames", {
-                    "frames_processed": frame_idx,
-                    "total_frames": total_frames
-                })
-                logger.info(f"Processed {frame_idx}/{total_frames} frames")
         
-        cap.release()
+        _queue_put(output_queue, None, stop)
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise errors[0]
+        decoder.wait()
+        if frame_idx == 0:
+            raise RuntimeError("No frames could be read from the video")
         update_job_progress(job_id, 95, "encoding")
         
-        # Encode video using FFmpeg
-        output_path = frames_dir / "enhanced_output.mp4"
-        
-        # Determine encoding settings based on quality mode
-        if req.quality_mode == "best":
-            crf_value = "18"
-            preset = "slow"
-        elif req.quality_mode == "fast":
-            crf_value = "28"
-            preset = "veryfast"
-        else:  # balanced
-            crf_value = "23"
-            preset = "fast"
-        
-        logger.info(f"Encoding video with preset={preset}, crf={crf_value}")
-        
-        # Get original video for audio
-        audio_input = f"-i {video_path}"
-        
-        subprocess.run([
-            "ffmpeg", "-y",
-            "-framerate", str(fps),
-            "-i", str(frames_dir / "frame_%08d.png"),
-            "-i", str(video_path),
-            "-map", "0:v",
-            "-map", "1:a?",
-            "-c:v", "libx264",
-            "-pix_fmt", "yuv420p",
-            "-preset", preset,
-            "-crf", crf_value,
-            "-c:a", "aac",
-            "-shortest",
-            str(output_path)
-        ], check=True, capture_output=True)
+        # Flush the remaining frames through FFmpeg
+        _close_ffmpeg_encoder(encoder)
         
         update_job_progress(job_id, 100, "completed", {
             "output_path": str(output_path),
             "quality_mode": req.quality_mode,
-            "frames_processed": frame_idx
+            "frames_processed": frame_idx,
+            "encoder": video_codec_args[1]
         })
         
         logger.info(f"Enhancement complete: {output_path}")
@@ -284,8 +756,12 @@ def _do_enhance(job_id: str, req: EnhanceRequest):
         logger.error(f"Enhancement error: {traceback.format_exc()}")
         update_job_progress(job_id, 0, "error", {"error": str(e)})
     finally:
+        if stop is not None:
+            stop.set()
+        for proc in (decoder, encoder):
+            if proc is not None and proc.poll() is None:
+                proc.kill()
         # Note: Don't delete frames_dir here - let the backend handle cleanup
-        pass
 
 def _do_ffmpeg_enhance(job_id: str, req: EnhanceRequest):
     """Fallback enhancement using FFmpeg unsharp filter"""
@@ -304,16 +780,44 @@ def _do_ffmpeg_enhance(job_id: str, req: EnhanceRequest):
         else:  # balanced
             la_value = "1.5"
         
-        subprocess.run([
-            "ffmpeg", "-y",
-            "-i", str(video_path),
-            "-vf", f"unsharp=lx=5:ly=5:la={la_value}:cx=5:cy=5:ca=0.5",
-            "-c:v", "libx264",
-            "-preset", "fast",
-            "-crf", "23",
-            "-c:a", "copy",
-            str(output_path)
-        ], check=True, capture_output=True)
+        cap = cv2.VideoCapture(str(video_path))
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        
+        # Errors only on stderr, spooled to a temp file; progress comes as key=value lines on stdout
+        with tempfile.TemporaryFile() as ffmpeg_log:
+            proc = subprocess.Popen([
+                "ffmpeg", "-y",
+                "-loglevel", "error",
+                "-progress", "pipe:1",
+                "-nostats",
+                "-i", str(video_path),
+                "-vf", f"unsharp=lx=5:ly=5:la={la_value}:cx=5:cy=5:ca=0.5",
+                "-c:v", "libx264",
+                "-preset", "fast",
+                "-crf", "23",
+                "-c:a", "copy",
+                str(output_path)
+            ], stdout=subprocess.PIPE, stderr=ffmpeg_log, text=True)
+            
+            last_update = time.monotonic()
+            for line in proc.stdout:
+                key, _, value = line.strip().partition("=")
+                if key != "frame" or total_frames <= 0:
+                    continue
+                now = time.monotonic()
+                if now - last_update >= PROGRESS_INTERVAL:
+                    last_update = now
+                    frames_done = int(value)
+                    progress = 20 + min(frames_done / total_frames, 1.0) * 75
+                    update_job_progress(job_id, progress, "ffmpeg_processing", {
+                        "frames_processed": frames_done,
+                        "total_frames": total_frames
+                    })
+            
+            if proc.wait() != 0:
+                ffmpeg_log.seek(0)
+                raise RuntimeError(f"FFmpeg failed with exit code {proc.returncode}: {ffmpeg_log.read().decode(errors='replace').strip()}")
         
         update_job_progress(job_id, 100, "completed", {
             "output_path": str(output_path),
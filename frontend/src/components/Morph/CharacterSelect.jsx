@@ -1,4 +1,5 @@
 import { useState } from 'react';
+import { getMorphKeyframeUrl } from '../../services/api';
 
 /**
  * Shows keyframes with overlaid face boxes and track labels.
@@ -20,9 +21,9 @@ export default function CharacterSelect({ keyframes = [], selectedTrackId, onSel
           const imgH = kf.height || 360;
           return (
             <div key={i} className="relative rounded overflow-hidden border-2 border-slate-600 bg-slate-900">
-              {kf.imageBase64 ? (
+              {kf.imageUrl || kf.imageBase64 ? (
                 <img
-                  src={kf.imageBase64}
+                  src={kf.imageUrl ? getMorphKeyframeUrl(kf.imageUrl) : kf.imageBase64}
                   alt={`Frame ${kf.frameIndex}`}
                   className="w-full h-auto block"
                 />
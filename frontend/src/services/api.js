@@ -158,6 +158,11 @@ export async function morphDetectFaces(videoId, useCuda = true) {
   return res.data;
 }
 
+// Video Morph: keyframe thumbnail URL (imageUrl from detect-faces is relative to the morph service)
+export function getMorphKeyframeUrl(imageUrl) {
+  return `${API_BASE_URL}/morph${imageUrl}`;
+}
+
 // Video Morph: run face swap
 export async function morphRun(photoId, videoId, options = {}) {
   const { faceTrackId = 0, targetEmbedding = null, jobId = null, useCuda = true } = options;
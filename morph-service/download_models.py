@@ -1,40 +1,150 @@
 """
 Pre-download InsightFace models so the first API call doesn't wait.
-Run from morph-service: python download_models.py
+Run from morph-service: python download_models.py [--jobs N]
 """
 import os
+import re
 import sys
+import argparse
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Hugging Face mirror (official GitHub release URL often fails)
 INSWAPPER_HF_URL = "https://huggingface.co/ezioruan/inswapper_128.onnx/resolve/main/inswapper_128.onnx"
+USER_AGENT = "Vidzaro-Morph/1.0"
+DOWNLOAD_CONNECTIONS = 8
+DOWNLOAD_JOBS = 4  # Model packs fetched concurrently
+
+
+def _print_progress(downloaded: int, total: int) -> None:
+    if total and total > 0:
+        pct = min(100, 100 * downloaded / total)
+        print(f"\r  {pct:.1f}% ({downloaded // (1024*1024)} / {total // (1024*1024)} MB)", end="", flush=True)
+
+
+def _download_ranged(url: str, out_path: Path, connections: int = DOWNLOAD_CONNECTIONS) -> bool:
+    """Download url over parallel HTTP Range requests. Returns False if the server doesn't support ranges."""
+    import urllib.request
+    head = urllib.request.Request(url, method="HEAD", headers={"User-Agent": USER_AGENT})
+    with urllib.request.urlopen(head) as resp:
+        total = int(resp.headers.get("Content-Length", 0))
+        accepts_ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+        # Hugging Face redirects to its CDN; hit the final URL directly from every worker
+        url = resp.geturl()
+    if not accepts_ranges or total <= 0:
+        return False
+
+    with open(out_path, "wb") as f:
+        f.truncate(total)
+
+    part_size = -(-total // connections)
+    lock = threading.Lock()
+    progress = {"downloaded": 0}
+    errors = []
+
+    def fetch(start: int, end: int) -> None:
+        try:
+            req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT, "Range": f"bytes={start}-{end}"})
+            with urllib.request.urlopen(req) as resp, open(out_path, "r+b") as f:
+                if resp.status != 206:
+                    raise RuntimeError(f"Expected partial content, got HTTP {resp.status}")
+                # Each worker has its own handle, so seeks never race
+                f.seek(start)
+                while True:
+                    chunk = resp.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    with lock:
+                        progress["downloaded"] += len(chunk)
+                        _print_progress(progress["downloaded"], total)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=fetch, args=(start, min(start + part_size, total) - 1), daemon=True)
+        for start in range(0, total, part_size)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print()
+    if errors:
+        raise errors[0]
+    if progress["downloaded"] != total:
+        raise RuntimeError(f"Incomplete download: {progress['downloaded']} of {total} bytes")
+    return True
+
+
+def _download_single(url: str, out_path: Path) -> None:
+    import urllib.request
+    req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+    with urllib.request.urlopen(req) as resp:
+        total = int(resp.headers.get("Content-Length", 0))
+        downloaded = 0
+        chunk_size = 1024 * 1024  # 1 MB
+        with open(out_path, "wb") as f:
+            while True:
+                chunk = resp.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                downloaded += len(chunk)
+                _print_progress(downloaded, total)
+        print()
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _expected_sha256(url: str) -> str | None:
+    """SHA-256 of a Hugging Face LFS file (its X-Linked-Etag), or INSWAPPER_SHA256 if set."""
+    pinned = os.environ.get("INSWAPPER_SHA256")
+    if pinned:
+        return pinned.lower()
+    import urllib.error
+    import urllib.request
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        # The LFS hash is on the Hugging Face response, not on the CDN it redirects to
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    head = urllib.request.Request(url, method="HEAD", headers={"User-Agent": USER_AGENT})
+    try:
+        resp = urllib.request.build_opener(_NoRedirect).open(head)
+    except urllib.error.HTTPError as e:
+        resp = e  # the unfollowed 302 carries the headers we need
+    except Exception:
+        return None
+    etag = (resp.headers.get("X-Linked-Etag") or "").strip('"').lower()
+    return etag if re.fullmatch(r"[0-9a-f]{64}", etag) else None
 
 
 def download_inswapper_from_hf(models_dir: Path) -> Path:
     """Download inswapper_128.onnx from Hugging Face (fallback when InsightFace URL fails)."""
     out_path = models_dir / "inswapper_128.onnx"
+    expected = _expected_sha256(INSWAPPER_HF_URL)
     if out_path.exists():
-        print("inswapper_128.onnx already exists, skipping download.")
-        return out_path
+        if expected is None or _sha256(out_path) == expected:
+            print("inswapper_128.onnx already exists, skipping download.")
+            return out_path
+        print("inswapper_128.onnx checksum mismatch (partial or corrupt download), downloading again.")
+        out_path.unlink()
     try:
-        import urllib.request
         print("Downloading inswapper_128.onnx from Hugging Face (~554 MB)...")
-        req = urllib.request.Request(INSWAPPER_HF_URL, headers={"User-Agent": "Vidzaro-Morph/1.0"})
-        with urllib.request.urlopen(req) as resp:
-            total = int(resp.headers.get("Content-Length", 0))
-            downloaded = 0
-            chunk_size = 1024 * 1024  # 1 MB
-            with open(out_path, "wb") as f:
-                while True:
-                    chunk = resp.read(chunk_size)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total and total > 0:
-                        pct = min(100, 100 * downloaded / total)
-                        print(f"\r  {pct:.1f}% ({downloaded // (1024*1024)} / {total // (1024*1024)} MB)", end="", flush=True)
-            print()
+        if not _download_ranged(INSWAPPER_HF_URL, out_path):
+            _download_single(INSWAPPER_HF_URL, out_path)
+        if expected is not None and _sha256(out_path) != expected:
+            raise RuntimeError("SHA-256 mismatch after download")
         print("InSwapper ready.")
         return out_path
     except Exception as e:
@@ -43,32 +153,14 @@ def download_inswapper_from_hf(models_dir: Path) -> Path:
         raise RuntimeError(f"Failed to download inswapper_128.onnx: {e}") from e
 
 
-def main():
-    root = Path(__file__).resolve().parent
-    models_root = os.environ.get("MODELS_ROOT", str(root))
-    models_dir = Path(models_root) / "models"
-    models_dir.mkdir(parents=True, exist_ok=True)
-    os.environ["MODELS_ROOT"] = str(root)
-    # CPU only so we don't print CUDA DLL errors when GPU isn't set up
-    providers = ["CPUExecutionProvider"]
-
+def _download_buffalo(name: str, models_root: str, providers: list) -> None:
     from insightface.app import FaceAnalysis
-    from insightface.model_zoo import get_model
-
-    print("Downloading detection model (buffalo_l for better quality)...")
-    app = FaceAnalysis(name="buffalo_l", root=models_root, providers=providers)  # Upgraded model
+    app = FaceAnalysis(name=name, root=models_root, providers=providers)
     app.prepare(ctx_id=0, det_size=(640, 640))
-    print("Detection model ready.")
-    
-    print("Also downloading buffalo_s for compatibility...")
-    try:
-        app_s = FaceAnalysis(name="buffalo_s", root=models_root, providers=providers)
-        app_s.prepare(ctx_id=0, det_size=(640, 640))
-        print("Buffalo_s model ready.")
-    except:
-        print("Buffalo_s download failed (optional)")
 
-    print("Downloading inswapper_128.onnx...")
+
+def _download_inswapper(models_root: str, models_dir: Path, providers: list) -> None:
+    from insightface.model_zoo import get_model
     inswapper_path = models_dir / "inswapper_128.onnx"
     if inswapper_path.exists():
         print("inswapper_128.onnx already exists.")
@@ -82,47 +174,73 @@ def main():
                 get_model(str(inswapper_path), root=models_root, download=False, providers=providers)
             else:
                 raise
-    print("InSwapper ready.")
 
-    print("Downloading GFPGAN model...")
-    try:
-        from gfpgan import GFPGANer
-        model_url = 'https://github.com/TencentARC/GFPGAN/releases/download/v1.3.4/GFPGANv1.4.pth'
-        # Just initialize it (CPU is fine for download)
-        GFPGANer(model_path=model_url, upscale=1, arch='clean', channel_multiplier=2, bg_upsampler=None, device='cpu')
-        print("GFPGAN ready.")
-    except Exception as e:
-        print(f"Warning: Failed to pre-download GFPGAN: {e}")
 
-    print("Attempting to download CodeFormer model...")
-    try:
-        # This will attempt to download CodeFormer model if available
-        import torch
+def _download_gfpgan() -> None:
+    from gfpgan import GFPGANer
+    model_url = 'https://github.com/TencentARC/GFPGAN/releases/download/v1.3.4/GFPGANv1.4.pth'
+    # Just initialize it (CPU is fine for download)
+    GFPGANer(model_path=model_url, upscale=1, arch='clean', channel_multiplier=2, bg_upsampler=None, device='cpu')
+
+
+def _download_face_alignment() -> None:
+    from face_alignment import FaceAlignment, LandmarksType
+    FaceAlignment(LandmarksType._2D, device='cpu')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-download morph-service models")
+    parser.add_argument("--jobs", type=int, default=DOWNLOAD_JOBS, help="Models to download concurrently")
+    args = parser.parse_args()
+
+    root = Path(__file__).resolve().parent
+    models_root = os.environ.get("MODELS_ROOT", str(root))
+    models_dir = Path(models_root) / "models"
+    models_dir.mkdir(parents=True, exist_ok=True)
+    os.environ["MODELS_ROOT"] = str(root)
+    # CPU only so we don't print CUDA DLL errors when GPU isn't set up
+    providers = ["CPUExecutionProvider"]
+
+    # (label, fn, required) - independent files, so they download side by side
+    tasks = [
+        ("buffalo_l (HD detection)", lambda: _download_buffalo("buffalo_l", models_root, providers), True),
+        ("buffalo_s", lambda: _download_buffalo("buffalo_s", models_root, providers), False),
+        ("Enhanced inswapper", lambda: _download_inswapper(models_root, models_dir, providers), True),
+        ("GFPGAN v1.4 (2x enhancement)", _download_gfpgan, False),
+        ("Face alignment", _download_face_alignment, False),
+    ]
+
+    def run(task):
+        label, fn, _ = task
+        print(f"Downloading {label}...")
         try:
-            from basicsr.utils import img2tensor
-            print("CodeFormer dependencies available.")
-        except ImportError:
-            print("CodeFormer dependencies not fully available.")
-    except Exception as e:
-        print(f"CodeFormer not available: {e}")
+            fn()
+            print(f"{label} ready.")
+            return None
+        except Exception as e:
+            print(f"Warning: {label} failed: {e}")
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        results = list(pool.map(run, tasks))
+
+    for (label, _, required), err in zip(tasks, results):
+        if err is not None and required:
+            raise RuntimeError(f"Failed to download {label}") from err
 
-    print("Attempting to download face alignment models...")
     try:
-        from face_alignment import FaceAlignment, LandmarksType
-        fa = FaceAlignment(LandmarksType._2D, device='cpu')
-        print("Face alignment models ready.")
-    except Exception as e:
-        print(f"Face alignment models failed (optional): {e}")
+        from basicsr.utils import img2tensor
+        codeformer = True
+    except ImportError:
+        codeformer = False
 
     print("All available models downloaded to", models_dir)
     print("\n🚀 Models ready! Enhanced quality features available:")
-    print("  ✅ buffalo_l (HD detection)")
-    print("  ✅ Enhanced inswapper")  
-    print("  ✅ GFPGAN v1.4 (2x enhancement)")
-    if 'CodeFormer' in str(locals()):
+    for (label, _, _), err in zip(tasks, results):
+        if err is None:
+            print(f"  ✅ {label}")
+    if codeformer:
         print("  ✅ CodeFormer support")
-    if 'face_alignment' in str(locals()):  
-        print("  ✅ Face alignment")
     print("\n💡 Your service now supports HD face detection and enhanced quality!")
 
 if __name__ == "__main__":
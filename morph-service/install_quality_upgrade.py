@@ -5,8 +5,27 @@ Quality Enhancement Installation Script for Vidzaro Morph Service
 import subprocess
 import sys
 import os
+import random
+import time
+import glob
 from pathlib import Path
 
+# Network hiccups worth retrying (PyPI/CDN timeouts, resets, throttling); anything else fails fast
+TRANSIENT_ERROR_MARKERS = ("timed out", "Connection reset", "HTTPSConnectionPool", "Temporary failure in name resolution")
+
+def _retry(fn, n=3, base=1.0, cap=30.0, jitter=0.5):
+    """Call fn(), retrying transient CalledProcessErrors with exponential backoff and jitter"""
+    for attempt in range(n + 1):
+        try:
+            return fn()
+        except subprocess.CalledProcessError as e:
+            output = f"{e.stdout or ''}{e.stderr or ''}"
+            if attempt == n or not any(marker in output for marker in TRANSIENT_ERROR_MARKERS):
+                raise
+            delay = min(cap, base * 2 ** attempt) * (1 + random.uniform(0, jitter))
+            print(f"⏳ Transient network error, retrying in {delay:.1f}s ({attempt + 1}/{n})...")
+            time.sleep(delay)
+
 def run_command(cmd, description=""):
     """Run a command and handle errors"""
     print(f"\n{'='*50}")
@@ -15,7 +34,9 @@ def run_command(cmd, description=""):
     print(f"Running: {' '.join(cmd)}")
     
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        run = lambda: subprocess.run(cmd, check=True, capture_output=True, text=True)
+        # Only network-bound steps are worth retrying
+        result = _retry(run) if description.startswith(("Installing", "Downloading")) else run()
         print("✅ SUCCESS")
         if result.stdout.strip():
             print(f"Output: {result.stdout.strip()}")
@@ -28,15 +49,33 @@ def run_command(cmd, description=""):
             print(f"STDERR: {e.stderr}")
         return False
 
+NVIDIA_PCI_VENDOR_ID = "0x10de"
+
+def _has_nvidia_pci_device():
+    """Look for an NVIDIA PCI device in sysfs; None where sysfs isn't available (e.g. Windows)"""
+    vendor_files = glob.glob("/sys/bus/pci/devices/*/vendor")
+    if not vendor_files:
+        return None
+    for path in vendor_files:
+        try:
+            with open(path) as f:
+                if f.read().strip().lower() == NVIDIA_PCI_VENDOR_ID:
+                    return True
+        except OSError:
+            continue
+    return False
+
 def check_gpu():
     """Check if CUDA GPU is available"""
-    try:
-        result = subprocess.run(["nvidia-smi"], capture_output=True, text=True)
-        if result.returncode == 0:
-            print("🚀 NVIDIA GPU detected - will use CUDA acceleration")
-            return True
-    except FileNotFoundError:
-        pass
+    # Reading sysfs is instant; nvidia-smi can stall for seconds when the driver is missing
+    if _has_nvidia_pci_device() is not False:
+        try:
+            result = subprocess.run(["nvidia-smi"], capture_output=True, text=True, timeout=15)
+            if result.returncode == 0:
+                print("🚀 NVIDIA GPU detected - will use CUDA acceleration")
+                return True
+        except (FileNotFoundError, subprocess.TimeoutExpired):
+            pass
     print("💻 No NVIDIA GPU detected - will use CPU mode")
     return False
 
@@ -98,13 +137,20 @@ def main():
     ]
     
     print("\n🎨 Installing optional quality enhancement packages...")
-    for package in optional_packages:
-        success = run_command([
-            sys.executable, "-m", "pip", "install", package
-        ], f"Installing {package}")
-        
-        if not success:
-            print(f"⚠️  {package} installation failed (optional)")
+    # One pip run resolves and downloads everything together; only fall back to
+    # per-package installs (to isolate the failure) when the batch fails
+    success = run_command([
+        sys.executable, "-m", "pip", "install", *optional_packages
+    ], "Installing optional packages")
+    
+    if not success:
+        for package in optional_packages:
+            success = run_command([
+                sys.executable, "-m", "pip", "install", package
+            ], f"Installing {package}")
+            
+            if not success:
+                print(f"⚠️  {package} installation failed (optional)")
     
     # Try CodeFormer separately as it's more complex
     print("\n🔧 Attempting CodeFormer installation...")
@@ -132,7 +178,7 @@ def main():
     # 5. Download models
     print("\n📦 Downloading enhanced AI models...")
     success = run_command([
-        sys.executable, "download_models.py"
+        sys.executable, "download_models.py", "--jobs", os.environ.get("MORPH_DOWNLOAD_JOBS", "4")
     ], "Downloading AI models")
     
     if not success:
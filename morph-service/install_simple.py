@@ -6,15 +6,35 @@ Focuses on core improvements that are most likely to work
 import subprocess
 import sys
 import os
+import random
+import time
 from pathlib import Path
 
+# Network hiccups worth retrying (PyPI/CDN timeouts, resets, throttling); anything else fails fast
+TRANSIENT_ERROR_MARKERS = ("timed out", "Connection reset", "HTTPSConnectionPool", "Temporary failure in name resolution")
+
+def _retry(fn, n=3, base=1.0, cap=30.0, jitter=0.5):
+    """Call fn(), retrying transient CalledProcessErrors with exponential backoff and jitter"""
+    for attempt in range(n + 1):
+        try:
+            return fn()
+        except subprocess.CalledProcessError as e:
+            output = f"{e.stdout or ''}{e.stderr or ''}"
+            if attempt == n or not any(marker in output for marker in TRANSIENT_ERROR_MARKERS):
+                raise
+            delay = min(cap, base * 2 ** attempt) * (1 + random.uniform(0, jitter))
+            print(f"⏳ Transient network error, retrying in {delay:.1f}s ({attempt + 1}/{n})...")
+            time.sleep(delay)
+
 def run_command(cmd, description=""):
     """Run a command and handle errors"""
     print(f"\n🔧 {description}")
     print(f"Running: {' '.join(cmd)}")
     
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        run = lambda: subprocess.run(cmd, check=True, capture_output=True, text=True)
+        # Only network-bound steps are worth retrying
+        result = _retry(run) if description.startswith(("Installing", "Downloading")) else run()
         print("✅ SUCCESS")
         return True
     except subprocess.CalledProcessError as e:
@@ -52,7 +72,7 @@ def main():
     # 3. Download models
     print("\n📦 Downloading enhanced AI models...")
     success = run_command([
-        sys.executable, "download_models.py"
+        sys.executable, "download_models.py", "--jobs", os.environ.get("MORPH_DOWNLOAD_JOBS", "4")
     ], "Downloading AI models")
     
     if not success:
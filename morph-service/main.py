@@ -8,11 +8,21 @@ import json
 import base64
 import tempfile
 import subprocess
+import shutil
 import uuid
+import queue
+import threading
+import random
 import importlib
+import importlib.util
 import site
+import contextlib
+import functools
+import hashlib
+import time
 import traceback
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # Fix for GFPGAN/BasicsSR: torchvision removed functional_tensor in newer versions
 from types import ModuleType
@@ -46,14 +56,15 @@ logger = logging.getLogger(__name__)
 
 # Add NVIDIA CUDA pip package paths to PATH so onnxruntime-gpu finds cublasLt64_12.dll etc.
 # (avoids needing the full CUDA Toolkit when using nvidia-cublas-cu12 / nvidia-cudnn-cu12 from pip)
+@functools.lru_cache(maxsize=1)
 def _add_nvidia_cuda_paths():
     paths_to_add = []
-    # 1. Try explicit imports for well-known packages
+    # 1. Locate well-known packages without importing (executing) them
     for pkg_name in ("nvidia.cublas", "nvidia.cudnn", "nvidia.cufft", "nvidia.curand", "nvidia.cusolver", "nvidia.cusparse"):
         try:
-            mod = importlib.import_module(pkg_name)
-            if hasattr(mod, "__path__"):
-                pkg_dir = Path(mod.__path__[0]).resolve()
+            spec = importlib.util.find_spec(pkg_name)
+            if spec is not None and spec.submodule_search_locations:
+                pkg_dir = Path(list(spec.submodule_search_locations)[0]).resolve()
                 for sub in ("bin", "lib"):
                     d = pkg_dir / sub
                     if d.is_dir():
@@ -92,9 +103,13 @@ def _add_nvidia_cuda_paths():
 
 _add_nvidia_cuda_paths()
 
+# Load CUDA kernels on first use instead of all at context creation (faster start, less memory)
+os.environ.setdefault("CUDA_MODULE_LOADING", "LAZY")
+
 import cv2
 import numpy as np
 from fastapi import FastAPI, HTTPException, Body
+from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 try:
     from skimage import transform as trans
@@ -110,12 +125,9 @@ except ImportError:
 
 app = FastAPI(title="Video Morph Service")
 
-def _cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
-    """Cosine similarity; assumes embeddings may be unnormalized."""
-    na, nb = np.linalg.norm(a), np.linalg.norm(b)
-    if na < 1e-8 or nb < 1e-8:
-        return 0.0
-    return float(np.dot(a, b) / (na * nb + 1e-8))
+def _cosine_sim_prenorm(a_unit: np.ndarray, b_unit: np.ndarray) -> float:
+    """Cosine similarity of two embeddings that are already unit-length."""
+    return float(a_unit @ b_unit)
 
 # InsightFace expects root such that models live in root/models/ (e.g. root/models/buffalo_sc/)
 MORPH_ROOT = Path(__file__).resolve().parent
@@ -125,96 +137,316 @@ Path(MODELS_ROOT).mkdir(parents=True, exist_ok=True)
 Path(TEMP_DIR).mkdir(parents=True, exist_ok=True)
 
 # Lazy-load heavy deps
-_face_app = None
-_face_app_hd = None  # High-definition face detector
-_swapper = None
-_enhancer = None
-_codeformer = None
-_face_parser = None
+# ONNX models are cached per provider list, so flipping use_cuda between requests
+# switches to an already-warm instance instead of rebuilding sessions
+_face_apps = {}  # (providers, det_size, allowed_modules) -> prepared FaceAnalysis
+_swappers = {}  # providers -> INSwapper
+# Torch models pick their device at load time; keep one per CPU/CUDA preference
+_enhancers = {}  # prefer_cpu -> GFPGANer or "failed"
+_codeformers = {}
+_face_parsers = {}
 # Override from request: None = use env; True = CPU only; False = prefer CUDA
 _prefer_cpu_override: bool | None = None
 
 # Quality settings
 HD_DETECTION_SIZE = (1024, 1024)  # Higher resolution for better detection
+# /detect-faces and /swap only need boxes, 5-point kps and identity embeddings; skip the
+# landmark_2d_106 / landmark_3d_68 and gender/age models that FaceAnalysis runs per face by default.
+# Both endpoints use the same modules so /detect-faces track embeddings match swap-time ones.
+FACE_MODULES = ("detection", "recognition")
 TEMPORAL_SMOOTH_FRAMES = 5  # Frames to consider for temporal smoothing
 QUALITY_THRESHOLD = 0.6  # Higher threshold for better face matches
+REC_BATCH_SIZE = 32  # Aligned face crops per batched ArcFace run in /detect-faces
+DETECT_WORKERS = max(1, int(os.environ.get("MORPH_DETECT_WORKERS", "2") or 2))  # Concurrent face_app.get calls over /detect-faces keyframes
+MOTION_GATE_THRESHOLD = 4.0  # Mean abs diff of 64x64 grayscale thumbnails below which a frame counts as static
+MOTION_GATE_MAX_SKIP = 5  # Max consecutive frames that reuse the previous detections
+ROI_DET_SIZE = 320  # Detector input (multiple of 32) when re-detecting around the last target face
+ROI_PAD = 0.75  # The ROI grows the target bbox by this fraction of its longest side on every edge
+ROI_DETECT_MAX_FRAMES = 5  # Consecutive ROI-only detections before a full-frame pass
+ROI_REUSE_IOU = 0.7  # A lone ROI face overlapping the last target this much reuses its embedding (no ArcFace run)
+ROI_REUSE_MAX_MOTION = 12.0  # ...unless the thumbnail diff (as for MOTION_GATE_THRESHOLD) suggests a cut
+SWAP_QUEUE_SIZE = 8  # Frames buffered between the decode, swap and encode stages
+KEYFRAME_THUMB_MAX = 512  # Longest side of /detect-faces keyframe thumbnails
+KEYFRAME_JPEG_QUALITY = 80
+KEYFRAMES_DIR = Path(TEMP_DIR) / "morph_keyframes"  # Served at /keyframes/<batch>/<i>.jpg
+KEYFRAMES_TTL_SECONDS = 3600
+KEYFRAMES_DIR.mkdir(parents=True, exist_ok=True)
+app.mount("/keyframes", StaticFiles(directory=str(KEYFRAMES_DIR)), name="keyframes")
+# Run InSwapper from a cached FP16 conversion on CUDA (needs onnx + onnxconverter-common)
+USE_FP16_SWAPPER = os.environ.get("MORPH_FP16", "1").strip() == "1"
+# Run GFPGAN with half-precision weights under autocast on CUDA
+USE_FP16_ENHANCER = os.environ.get("MORPH_FP16_ENHANCER", "1").strip() == "1"
+# Load and run the default models once at startup so the first request doesn't pay for it
+PREWARM_MODELS = os.environ.get("MORPH_PREWARM", "1").strip() == "1"
+# Optional cap on each ONNX Runtime CUDA arena, in MB (0 = no limit)
+GPU_MEM_LIMIT_MB = int(os.environ.get("MORPH_GPU_MEM_LIMIT_MB", "0") or 0)
+# cuDNN conv algorithm selection: EXHAUSTIVE (benchmark once per shape) or HEURISTIC (no search)
+CUDNN_CONV_ALGO_SEARCH = os.environ.get("MORPH_CUDNN_ALGO_SEARCH", "EXHAUSTIVE").strip().upper()
+# ONNX Runtime intra-op threads per session (0 = half the logical cores)
+ORT_INTRA_OP_THREADS = int(os.environ.get("MORPH_ORT_THREADS", "0") or 0)
+# Save ORT-optimized graphs here and load them on later starts (MORPH_ORT_CACHE=0 disables)
+ORT_CACHE_DIR = Path(MODELS_ROOT) / "ort_cache" if os.environ.get("MORPH_ORT_CACHE", "1").strip() == "1" else None
+# Decode /swap input on NVDEC through FFmpeg when running on CUDA
+HW_DECODE = os.environ.get("MORPH_HW_DECODE", "1").strip() == "1"
+# Opt-in: run ArcFace from a dynamically INT8-quantized copy when on CPU only
+USE_INT8_RECOGNITION = os.environ.get("MORPH_INT8_REC", "0").strip() == "1"
+
+
+@functools.lru_cache(maxsize=1)
+def _ort_available_providers() -> tuple[str, ...]:
+    """Execution providers this onnxruntime build can create (probed once)."""
+    try:
+        import onnxruntime
+        return tuple(onnxruntime.get_available_providers())
+    except Exception:
+        return ("CPUExecutionProvider",)
+
+
+@functools.lru_cache(maxsize=4)
+def _providers_for(prefer_cpu: bool | None, use_cpu_env: str) -> tuple[str, ...]:
+    if prefer_cpu is True:
+        return ("CPUExecutionProvider",)
+    if prefer_cpu is None and use_cpu_env == "1":
+        return ("CPUExecutionProvider",)
+    # Skip CUDA up front on CPU-only onnxruntime builds instead of failing over per session
+    if "CUDAExecutionProvider" not in _ort_available_providers():
+        return ("CPUExecutionProvider",)
+    return ("CUDAExecutionProvider", "CPUExecutionProvider")
 
 
 def _get_providers():
-    if _prefer_cpu_override is True:
-        return ["CPUExecutionProvider"]
-    if _prefer_cpu_override is False:
-        return ["CUDAExecutionProvider", "CPUExecutionProvider"]
-    if os.environ.get("USE_CPU", "").strip() == "1":
-        return ["CPUExecutionProvider"]
-    return ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    return list(_providers_for(_prefer_cpu_override, os.environ.get("USE_CPU", "").strip()))
+
+
+def _get_provider_options():
+    """ONNX Runtime provider options, one dict per entry of _get_providers()."""
+    options = []
+    for provider in _get_providers():
+        if provider == "CUDAExecutionProvider":
+            cuda_options = {
+                # Grow the arena by what is requested rather than doubling, to limit fragmentation
+                "arena_extend_strategy": "kSameAsRequested",
+                # Every model runs at a fixed input shape, so an EXHAUSTIVE search happens once
+                # per shape and the startup warm-up pays for it
+                "cudnn_conv_algo_search": CUDNN_CONV_ALGO_SEARCH,
+                "cudnn_conv_use_max_workspace": "1",
+                "do_copy_in_default_stream": "1",
+            }
+            if GPU_MEM_LIMIT_MB > 0:
+                cuda_options["gpu_mem_limit"] = str(GPU_MEM_LIMIT_MB * 1024 * 1024)
+            options.append(cuda_options)
+        else:
+            options.append({})
+    return options
+
+
+def _session_options():
+    """SessionOptions for the InsightFace ONNX sessions."""
+    import onnxruntime
+    so = onnxruntime.SessionOptions()
+    so.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    so.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    # Detect workers and swap jobs run sessions concurrently, so one session shouldn't claim every core
+    so.intra_op_num_threads = ORT_INTRA_OP_THREADS or max(1, (os.cpu_count() or 2) // 2)
+    return so
+
+
+def _optimized_model_path(model_path, providers) -> Path | None:
+    """Cache file for a model's optimized graph, keyed by ORT version, providers and source file."""
+    if ORT_CACHE_DIR is None:
+        return None
+    import onnxruntime
+    src = Path(model_path)
+    st = src.stat()
+    key = repr((onnxruntime.__version__, list(providers or []), str(src.resolve()), st.st_size, st.st_mtime_ns))
+    return ORT_CACHE_DIR / f"{src.stem}.{hashlib.sha1(key.encode()).hexdigest()[:12]}.onnx"
+
+
+@functools.lru_cache(maxsize=1)
+def _install_session_options():
+    """Make InsightFace create its sessions with _session_options() and the optimized-graph cache.
+
+    FaceAnalysis and model_zoo.get_model only forward providers/provider_options to
+    onnxruntime.InferenceSession, so sess_options is injected at InsightFace's session class.
+    The first load writes the optimized graph to ORT_CACHE_DIR; later loads skip graph optimization.
+    InsightFace reads model metadata from model_file, so the session can come from the cached graph.
+    """
+    try:
+        import onnxruntime
+        from insightface.model_zoo import model_zoo
+        session_cls = model_zoo.PickableInferenceSession
+        original_init = session_cls.__init__
+
+        def __init__(self, model_path, **kwargs):
+            if "sess_options" in kwargs:
+                return original_init(self, model_path, **kwargs)
+            try:
+                cached = _optimized_model_path(model_path, kwargs.get("providers"))
+            except OSError:
+                cached = None
+            if cached is not None and cached.exists():
+                so = _session_options()
+                so.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+                try:
+                    original_init(self, str(cached), sess_options=so, **kwargs)
+                    self.model_path = model_path  # pickling reloads from the original
+                    return
+                except Exception as e:
+                    print(f"Discarding unusable optimized model {cached.name}: {e}")
+                    cached.unlink(missing_ok=True)
+            so = _session_options()
+            tmp = None
+            if cached is not None:
+                cached.parent.mkdir(parents=True, exist_ok=True)
+                tmp = cached.with_suffix(".tmp")
+                so.optimized_model_filepath = str(tmp)
+            original_init(self, model_path, sess_options=so, **kwargs)
+            if tmp is not None and tmp.exists():
+                tmp.replace(cached)
+
+        session_cls.__init__ = __init__
+    except Exception as e:
+        print(f"Using default ONNX Runtime session options: {e}")
 
 
 def _apply_use_cuda(use_cuda: bool | None):
-    """Apply request-level CPU/CUDA preference; clear cached models if preference changed."""
-    global _face_app, _face_app_hd, _swapper, _prefer_cpu_override, _enhancer, _codeformer, _face_parser
+    """Apply request-level CPU/CUDA preference; models for both settings stay cached."""
+    global _prefer_cpu_override
     if use_cuda is None:
         return
-    new_prefer_cpu = not use_cuda
-    if _prefer_cpu_override != new_prefer_cpu:
-        _prefer_cpu_override = new_prefer_cpu
-        _face_app = None
-        _face_app_hd = None
-        _swapper = None
-        _enhancer = None
-        _codeformer = None
-        _face_parser = None
-
-
-def get_face_app():
-    global _face_app
-    if _face_app is None:
+    _prefer_cpu_override = not use_cuda
+
+
+def _load_face_app(det_size, allowed_modules=None, label="FaceAnalysis"):
+    """Prepared FaceAnalysis for a detection size and module subset, built once per combination."""
+    key = (tuple(_get_providers()), det_size, allowed_modules)
+    if key not in _face_apps:
         try:
-            print("Loading FaceAnalysis model...")
+            print(f"Loading {label} model...")
             import insightface
             from insightface.app import FaceAnalysis
+            _install_session_options()
             model = os.environ.get("INSIGHTFACE_MODEL", "buffalo_l")  # Use larger, more accurate model
-            _face_app = FaceAnalysis(name=model, root=MODELS_ROOT, providers=_get_providers())
-            _face_app.prepare(ctx_id=0, det_size=(640, 640))  # Standard resolution for speed
-            print("FaceAnalysis loaded successfully.")
+            face_app = FaceAnalysis(name=model, root=MODELS_ROOT, providers=_get_providers(), provider_options=_get_provider_options(),
+                                    allowed_modules=list(allowed_modules) if allowed_modules else None)
+            face_app.prepare(ctx_id=0, det_size=det_size)
+            if USE_INT8_RECOGNITION and "recognition" in face_app.models and "CUDAExecutionProvider" not in _get_providers():
+                _use_int8_recognition(face_app)
+            _face_apps[key] = face_app
+            print(f"{label} loaded successfully.")
         except Exception as e:
-            print(f"Failed to load FaceAnalysis: {e}")
-            raise RuntimeError(f"Failed to load FaceAnalysis: {e}") from e
-    return _face_app
+            print(f"Failed to load {label}: {e}")
+            raise RuntimeError(f"Failed to load {label}: {e}") from e
+    return _face_apps[key]
+
+def _int8_recognition_path(src) -> Path | None:
+    """Dynamically INT8-quantized copy of a recognition model, converted once and cached.
 
-def get_face_app_hd():
+    Kept outside the model pack directory, which FaceAnalysis loads every *.onnx from.
+    """
+    src = Path(src)
+    dst = Path(MODELS_ROOT) / "models" / "int8" / f"{src.parent.name}_{src.stem}.int8.onnx"
+    if dst.exists():
+        return dst
+    try:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError:
+        return None
+    print(f"Quantizing {src.name} to INT8 (one-time)...")
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_suffix(".tmp")
+    quantize_dynamic(str(src), str(tmp), weight_type=QuantType.QInt8)
+    tmp.replace(dst)
+    return dst
+
+def _use_int8_recognition(face_app):
+    """Replace face_app's ArcFace model with its INT8 copy; keeps FP32 on any failure."""
+    try:
+        int8_path = _int8_recognition_path(face_app.models["recognition"].model_file)
+        if int8_path is None:
+            return
+        from insightface.model_zoo import get_model
+        rec = get_model(str(int8_path), providers=_get_providers(), provider_options=_get_provider_options())
+        rec.prepare(ctx_id=0)
+        face_app.models["recognition"] = rec
+        print("ArcFace recognition running in INT8.")
+    except Exception as e:
+        print(f"INT8 recognition unavailable, using FP32: {e}")
+
+def get_face_app(allowed_modules=None):
+    """Standard-resolution detector (640x640) for speed; allowed_modules restricts which models run."""
+    return _load_face_app((640, 640), allowed_modules)
+
+def get_face_app_hd(allowed_modules=None):
     """High-definition face detector for better quality detection"""
-    global _face_app_hd
-    if _face_app_hd is None:
+    return _load_face_app(HD_DETECTION_SIZE, allowed_modules, label="HD FaceAnalysis")
+
+
+def _retry_download(fn, n=3, base=1.0, cap=30.0, jitter=0.5):
+    """Call fn(), retrying InsightFace "Failed downloading" errors with exponential backoff and jitter."""
+    for attempt in range(n + 1):
         try:
-            print("Loading HD FaceAnalysis model...")
-            import insightface
-            from insightface.app import FaceAnalysis
-            model = os.environ.get("INSIGHTFACE_MODEL", "buffalo_l")
-            _face_app_hd = FaceAnalysis(name=model, root=MODELS_ROOT, providers=_get_providers())
-            _face_app_hd.prepare(ctx_id=0, det_size=HD_DETECTION_SIZE)  # Higher resolution
-            print("HD FaceAnalysis loaded successfully.")
-        except Exception as e:
-            print(f"Failed to load HD FaceAnalysis: {e}")
-            raise RuntimeError(f"Failed to load HD FaceAnalysis: {e}") from e
-    return _face_app_hd
+            return fn()
+        except RuntimeError as e:
+            if attempt == n or "Failed downloading" not in str(e):
+                raise
+            delay = min(cap, base * 2 ** attempt) * (1 + random.uniform(0, jitter))
+            print(f"Model download failed, retrying in {delay:.1f}s ({attempt + 1}/{n})...")
+            time.sleep(delay)
+
+
+def _fp16_swapper_path() -> Path | None:
+    """Half-precision copy of inswapper_128.onnx, converted once and cached next to the original."""
+    src = Path(MODELS_ROOT) / "models" / "inswapper_128.onnx"
+    dst = src.with_name("inswapper_128.fp16.onnx")
+    if dst.exists():
+        return dst
+    if not src.exists():
+        return None
+    try:
+        import onnx
+        from onnxconverter_common import float16
+    except ImportError:
+        return None
+    print("Converting InSwapper to FP16 (one-time)...")
+    # Keep float32 inputs/outputs so INSwapper's pre/post-processing is unchanged
+    model = float16.convert_float_to_float16(onnx.load(str(src)), keep_io_types=True)
+    tmp = dst.with_suffix(".tmp")
+    onnx.save(model, str(tmp))
+    tmp.replace(dst)
+    return dst
 
 
 def get_swapper():
-    global _swapper
+    key = tuple(_get_providers())
+    _swapper = _swappers.get(key)
+    if _swapper is None:
+        _install_session_options()
+    if _swapper is None and USE_FP16_SWAPPER and "CUDAExecutionProvider" in _get_providers():
+        try:
+            fp16_path = _fp16_swapper_path()
+            if fp16_path is not None:
+                from insightface.model_zoo import get_model
+                swapper = get_model(str(fp16_path), root=MODELS_ROOT, download=False, providers=_get_providers(), provider_options=_get_provider_options())
+                # emap is read from the graph's initializers; keep the latent projection in fp32
+                swapper.emap = np.asarray(swapper.emap, dtype=np.float32)
+                _swapper = swapper
+                print("InSwapper loaded in FP16.")
+        except Exception as e:
+            print(f"FP16 InSwapper unavailable, using FP32: {e}")
     if _swapper is None:
         try:
             print("Loading InSwapper model...")
             from insightface.model_zoo import get_model
             prov = _get_providers()
-            _swapper = get_model("inswapper_128.onnx", root=MODELS_ROOT, download=True, providers=prov)
+            _swapper = _retry_download(lambda: get_model("inswapper_128.onnx", root=MODELS_ROOT, download=True, providers=prov, provider_options=_get_provider_options()))
             print("InSwapper loaded successfully.")
         except RuntimeError as e:
             if "Failed downloading" in str(e):
                 local_path = Path(MODELS_ROOT) / "models" / "inswapper_128.onnx"
                 if local_path.exists():
                     print(f"Found local swapper model at {local_path}")
-                    _swapper = get_model(str(local_path), root=MODELS_ROOT, download=False, providers=_get_providers())
+                    _swapper = get_model(str(local_path), root=MODELS_ROOT, download=False, providers=_get_providers(), provider_options=_get_provider_options())
                 else:
                     print("InSwapper model not found locally and download failed.")
                     raise RuntimeError(
@@ -226,11 +458,17 @@ def get_swapper():
         except Exception as e:
             print(f"Failed to load InSwapper: {e}")
             raise RuntimeError(f"Failed to load InSwapper: {e}") from e
+    _swappers[key] = _swapper
     return _swapper
 
 
+def _torch_model_key():
+    """Cache key for torch models: whether they were loaded with CPU forced."""
+    return _prefer_cpu_override is True
+
 def get_enhancer():
-    global _enhancer
+    key = _torch_model_key()
+    _enhancer = _enhancers.get(key)
     if _enhancer is None:
         try:
             print("Loading GFPGAN enhancer...")
@@ -249,19 +487,32 @@ def get_enhancer():
                 bg_upsampler=None,
                 device=device
             )
+            if device.type == 'cuda' and USE_FP16_ENHANCER:
+                # Autocast (see _enhancer_autocast) handles the FP32 input tensor
+                _enhancer.gfpgan.half()
             print("GFPGAN enhancer loaded successfully.")
         except Exception as e:
             print(f"Failed to load GFPGAN: {e}")
             # Non-fatal, mark as 'failed' so we don't try every 10 frames
             _enhancer = "failed"
+            _enhancers[key] = _enhancer
             return None
+        _enhancers[key] = _enhancer
     if _enhancer == "failed":
         return None
     return _enhancer
 
+def _enhancer_autocast(enhancer):
+    """FP16 autocast context for GFPGAN when its weights were halved, else a no-op."""
+    import torch
+    if USE_FP16_ENHANCER and enhancer.device.type == 'cuda':
+        return torch.autocast(device_type='cuda', dtype=torch.float16)
+    return contextlib.nullcontext()
+
 def get_codeformer():
     """CodeFormer for advanced face enhancement"""
-    global _codeformer
+    key = _torch_model_key()
+    _codeformer = _codeformers.get(key)
     if _codeformer is None:
         try:
             print("Loading CodeFormer enhancer...")
@@ -279,17 +530,20 @@ def get_codeformer():
                 # For now, mark as available but don't fully initialize 
                 # due to potential compatibility issues
                 _codeformer = "available_but_limited"
+                _codeformers[key] = _codeformer
                 print("CodeFormer marked as available (limited implementation)")
                 return None  # Return None for now, can be enhanced later
                 
             except ImportError as e:
                 print(f"CodeFormer dependencies missing: {e}")
                 _codeformer = "not_available"
+                _codeformers[key] = _codeformer
                 return None
                 
         except Exception as e:
             print(f"Failed to load CodeFormer: {e}")
             _codeformer = "failed"
+            _codeformers[key] = _codeformer
             return None
     if _codeformer in ["failed", "not_available", "available_but_limited"]:
         return None
@@ -297,7 +551,8 @@ def get_codeformer():
 
 def get_face_parser():
     """Face parser for better face segmentation"""
-    global _face_parser
+    key = _torch_model_key()
+    _face_parser = _face_parsers.get(key)
     if _face_parser is None:
         try:
             print("Loading Face Parser...")
@@ -308,41 +563,110 @@ def get_face_parser():
             try:
                 from face_alignment import FaceAlignment, LandmarksType
                 _face_parser = FaceAlignment(LandmarksType._2D, device=str(device))
+                _face_parsers[key] = _face_parser
                 print("Face Parser loaded successfully.")
             except ImportError:
                 print("Face-alignment not available")
                 _face_parser = "not_available"
+                _face_parsers[key] = _face_parser
                 return None
         except Exception as e:
             print(f"Failed to load Face Parser: {e}")
             _face_parser = "failed"
+            _face_parsers[key] = _face_parser
             return None
     if _face_parser in ["failed", "not_available"]:
         return None
     return _face_parser
 
 
-def iou_box(a, b):
-    """IoU of two boxes [x1,y1,x2,y2]."""
-    ax1, ay1, ax2, ay2 = a
-    bx1, by1, bx2, by2 = b
-    ix1 = max(ax1, bx1)
-    iy1 = max(ay1, by1)
-    ix2 = min(ax2, bx2)
-    iy2 = min(ay2, by2)
-    if ix2 <= ix1 or iy2 <= iy1:
-        return 0.0
-    inter = (ix2 - ix1) * (iy2 - iy1)
-    area_a = (ax2 - ax1) * (ay2 - ay1)
-    area_b = (bx2 - bx1) * (by2 - by1)
-    return inter / (area_a + area_b - inter + 1e-6)
+def _iou_matrix(dets: np.ndarray, tracks: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of D detection boxes against T track boxes ([x1,y1,x2,y2] rows); returns D x T."""
+    dets = np.asarray(dets, dtype=np.float32).reshape(-1, 4)
+    tracks = np.asarray(tracks, dtype=np.float32).reshape(-1, 4)
+    ix1 = np.maximum(dets[:, None, 0], tracks[None, :, 0])
+    iy1 = np.maximum(dets[:, None, 1], tracks[None, :, 1])
+    ix2 = np.minimum(dets[:, None, 2], tracks[None, :, 2])
+    iy2 = np.minimum(dets[:, None, 3], tracks[None, :, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area_d = (dets[:, 2] - dets[:, 0]) * (dets[:, 3] - dets[:, 1])
+    area_t = (tracks[:, 2] - tracks[:, 0]) * (tracks[:, 3] - tracks[:, 1])
+    return inter / (area_d[:, None] + area_t[None, :] - inter + 1e-6)
+
+def _stack_track_embeddings(track_embeddings):
+    """Flatten trackId -> [unit embeddings] into one matrix for one-GEMV similarity per detection.
+
+    Returns (track_ids, owner, matrix) where matrix row j belongs to track_ids[owner[j]].
+    """
+    track_ids = [tid for tid, embs in track_embeddings.items() if embs]
+    if not track_ids:
+        return track_ids, np.empty(0, dtype=np.intp), np.empty((0, 0), dtype=np.float32)
+    counts = [len(track_embeddings[tid]) for tid in track_ids]
+    owner = np.repeat(np.arange(len(track_ids)), counts)
+    matrix = np.stack([e for tid in track_ids for e in track_embeddings[tid]]).astype(np.float32, copy=False)
+    return track_ids, owner, matrix
+
+def _combine_track_sims(sims: np.ndarray, owner: np.ndarray, n_tracks: int) -> np.ndarray:
+    """Per-track 0.7 * max + 0.3 * mean of row similarities (sims[j] belongs to track owner[j])."""
+    max_sim = np.full(n_tracks, -np.inf, dtype=np.float32)
+    np.maximum.at(max_sim, owner, sims)
+    avg_sim = np.bincount(owner, weights=sims, minlength=n_tracks) / np.maximum(np.bincount(owner, minlength=n_tracks), 1)
+    return 0.7 * max_sim + 0.3 * avg_sim
+
+class _TrackEmbeddingBank:
+    """Growable matrix of unit embeddings for the /swap tracker, at most `per_track` rows per track.
+
+    Rows are written in place (capacity doubles when full), so scoring a detection is one
+    GEMV over the filled rows with no per-frame restacking of Python lists.
+    """
+
+    def __init__(self, per_track: int = 8, capacity: int = 64):
+        self.per_track = per_track
+        self.matrix = None  # (capacity, D), allocated from the first embedding's size
+        self.owner = np.empty(capacity, dtype=np.intp)  # row -> index into track_ids
+        self.track_ids = []  # column order of scores()
+        self._cols = {}
+        self._counts = []
+        self.n = 0
+
+    def add(self, tid, emb: np.ndarray):
+        col = self._cols.get(tid)
+        if col is None:
+            col = self._cols[tid] = len(self.track_ids)
+            self.track_ids.append(tid)
+            self._counts.append(0)
+        if self._counts[col] >= self.per_track:
+            return
+        if self.matrix is None:
+            self.matrix = np.empty((len(self.owner), emb.shape[0]), dtype=np.float32)
+        elif self.n == len(self.matrix):
+            self.matrix = np.concatenate([self.matrix, np.empty_like(self.matrix)])
+            self.owner = np.concatenate([self.owner, np.empty_like(self.owner)])
+        self.matrix[self.n] = emb
+        self.owner[self.n] = col
+        self._counts[col] += 1
+        self.n += 1
+
+    def scores(self, emb: np.ndarray) -> np.ndarray:
+        """Combined similarity of a unit embedding to each track, in track_ids order."""
+        return _combine_track_sims(self.matrix[:self.n] @ emb, self.owner[:self.n], len(self.track_ids))
+
+def _face_unit_embedding(face):
+    """Unit-length float32 embedding of an InsightFace face, or None without recognition.
+
+    Face.normed_embedding is already L2-normalized; only a bare embedding needs the norm.
+    """
+    emb = getattr(face, "normed_embedding", None)
+    if emb is not None:
+        return np.asarray(emb, dtype=np.float32)
+    return normalize_face_embedding(getattr(face, "embedding", None))
 
 def normalize_face_embedding(embedding):
     """Normalize face embedding for better similarity comparisons"""
     if embedding is None:
         return None
-    emb = np.asarray(embedding, dtype=np.float32)
-    norm = np.linalg.norm(emb)
+    emb = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = float(np.sqrt(emb @ emb))  # cheaper than np.linalg.norm for a single 512-vector
     if norm < 1e-8:
         return emb
     return emb / norm
@@ -403,15 +727,15 @@ def apply_temporal_smoothing(current_face, face_history, alpha=0.7):
     if not face_history:
         return current_face
     
-    # Simple exponential moving average of face features
-    smoothed = current_face.copy()
+    # Simple exponential moving average of face features, accumulated in place in float32
+    acc = current_face.astype(np.float32)
     
     # Blend with previous frames
     for i, prev_face in enumerate(reversed(face_history[-TEMPORAL_SMOOTH_FRAMES:])):
         weight = alpha ** (i + 1)
-        smoothed = cv2.addWeighted(smoothed, 1 - weight, prev_face, weight, 0)
+        cv2.accumulateWeighted(prev_face, acc, weight)  # acc = (1 - weight) * acc + weight * prev
     
-    return smoothed
+    return cv2.convertScaleAbs(acc)
 
 def apply_temporal_smoothing_region(frame_rgb, face_history, bbox, alpha=0.7):
     """Apply temporal smoothing only within the face bbox to avoid full-frame ghosting."""
@@ -429,16 +753,17 @@ def apply_temporal_smoothing_region(frame_rgb, face_history, bbox, alpha=0.7):
         return frame_rgb
 
     smoothed = frame_rgb.copy()
-    region = smoothed[y1:y2, x1:x2]
+    # One float32 accumulator for the whole chain instead of a new uint8 region per addWeighted
+    acc = smoothed[y1:y2, x1:x2].astype(np.float32)
 
     for i, prev in enumerate(reversed(face_history[-TEMPORAL_SMOOTH_FRAMES:])):
         prev_region = prev[y1:y2, x1:x2]
-        if prev_region.shape != region.shape:
+        if prev_region.shape != acc.shape:
             continue
         weight = alpha ** (i + 1)
-        region = cv2.addWeighted(region, 1 - weight, prev_region, weight, 0)
+        cv2.accumulateWeighted(prev_region, acc, weight)  # acc = (1 - weight) * acc + weight * prev
 
-    smoothed[y1:y2, x1:x2] = region
+    smoothed[y1:y2, x1:x2] = cv2.convertScaleAbs(acc)
     return smoothed
 
 def soften_swap_edges(original_rgb, swapped_rgb, bbox, blur_radius=0.08):
@@ -465,13 +790,15 @@ def soften_swap_edges(original_rgb, swapped_rgb, bbox, blur_radius=0.08):
     if rx2 <= rx1 or ry2 <= ry1:
         return swapped_rgb
     
-    orig_region = original_rgb[ry1:ry2, rx1:rx2].astype(np.float32)
-    swap_region = swapped_rgb[ry1:ry2, rx1:rx2].astype(np.float32)
+    # The regions stay uint8; only the single-channel masks are float32
+    orig_region = original_rgb[ry1:ry2, rx1:rx2]
+    swap_region = swapped_rgb[ry1:ry2, rx1:rx2]
     
-    diff = np.abs(swap_region - orig_region).mean(axis=2)
+    # Channel-sum of the absolute difference (mean > 5 <=> sum > 15), without a float upcast
+    diff = cv2.absdiff(swap_region, orig_region).sum(axis=2, dtype=np.uint16)
     
     # Binary mask of changed pixels
-    change_mask = (diff > 5.0).astype(np.float32)
+    change_mask = (diff > 15).astype(np.float32)
     
     if change_mask.sum() < 10:
         return swapped_rgb
@@ -483,12 +810,13 @@ def soften_swap_edges(original_rgb, swapped_rgb, bbox, blur_radius=0.08):
     
     # Ensure the interior stays at 1.0 (fully swapped)
     soft_mask = np.maximum(soft_mask, change_mask)
-    soft_mask = np.clip(soft_mask, 0, 1)[..., None]
+    soft_mask = np.clip(soft_mask, 0, 1)
     
-    blended = orig_region * (1. - soft_mask) + swap_region * soft_mask
+    # Per-pixel orig * (1 - mask) + swap * mask in one pass, straight to uint8
+    blended = cv2.blendLinear(orig_region, swap_region, 1. - soft_mask, soft_mask)
     
     result = swapped_rgb.copy()
-    result[ry1:ry2, rx1:rx2] = blended.astype(np.uint8)
+    result[ry1:ry2, rx1:rx2] = blended
     return result
 
 def multi_stage_enhancement(face_img, use_codeformer=True):
@@ -511,7 +839,8 @@ def multi_stage_enhancement(face_img, use_codeformer=True):
         if enhancer:
             try:
                 print("Applying GFPGAN enhancement...")
-                _, _, enhanced = enhancer.enhance(enhanced, has_aligned=False, only_center_face=False, paste_back=True)
+                with _enhancer_autocast(enhancer):
+                    _, _, enhanced = enhancer.enhance(enhanced, has_aligned=False, only_center_face=False, paste_back=True)
                 print("GFPGAN enhancement completed.")
             except Exception as e:
                 print(f"GFPGAN enhancement failed: {e}")
@@ -531,6 +860,10 @@ def multi_stage_enhancement(face_img, use_codeformer=True):
     
     return enhanced
 
+# 0.8 * identity + 0.2 * sharpen([[-1,-1,-1],[-1,9,-1],[-1,-1,-1]]): the sharpen and its mix in one filter2D
+_POST_SHARPEN_KERNEL = np.full((3, 3), -0.2, dtype=np.float32)
+_POST_SHARPEN_KERNEL[1, 1] = 2.6
+
 def apply_post_processing(img):
     """Apply post-processing for better visual quality"""
     try:
@@ -541,9 +874,7 @@ def apply_post_processing(img):
         enhanced = cv2.bilateralFilter(enhanced, 9, 75, 75)
         
         # Subtle sharpening
-        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-        sharpened = cv2.filter2D(enhanced, -1, kernel)
-        enhanced = cv2.addWeighted(enhanced, 0.8, sharpened, 0.2, 0)
+        enhanced = cv2.filter2D(enhanced, -1, _POST_SHARPEN_KERNEL)
         
         return enhanced
     except:
@@ -558,7 +889,7 @@ def update_job_progress(job_id: str, progress: float, status: str = "processing"
         "progress": round(progress, 2),
         "status": status,
         "result": result,
-        "updated_at": os.times()[4]
+        "updated_at": time.monotonic()
     }
 
 def assign_track_ids_embedding(detections_per_frame, sim_thresh=QUALITY_THRESHOLD):
@@ -577,67 +908,64 @@ def assign_track_ids_embedding(detections_per_frame, sim_thresh=QUALITY_THRESHOL
         new_frame = []
         used_ids_in_this_frame = set()
         
-        # Sort detections by quality (embedding presence and face size)
-        sorted_dets = sorted(frame_dets, key=lambda d: (
+        # Sort detections by quality (embedding presence and face size); a single face needs no sort
+        sorted_dets = list(frame_dets) if len(frame_dets) < 2 else sorted(frame_dets, key=lambda d: (
             d.get("embedding") is not None,
             d.get("quality_score", 0.0),
             (d.get("bbox", [0,0,0,0])[2] - d.get("bbox", [0,0,0,0])[0]) * 
             (d.get("bbox", [0,0,0,0])[3] - d.get("bbox", [0,0,0,0])[1])  # Face area
         ), reverse=True)
         
-        for det in sorted_dets:
+        # IoU and size consistency of every detection against every track's last box, once per frame.
+        # Tracks touched later in this frame are in used_ids_in_this_frame, so the snapshot stays valid.
+        # The same holds for the stacked track embeddings.
+        emb_track_ids, emb_owner, emb_matrix = _stack_track_embeddings(track_embeddings)
+        emb_quality = np.array([track_quality_scores.get(tid, 0.0) for tid in emb_track_ids], dtype=np.float32)
+        iou_track_ids = list(track_bbox.keys())
+        iou_scores = None
+        if iou_track_ids:
+            det_boxes = np.array([d["bbox"] if d.get("bbox") is not None and len(d["bbox"]) == 4 else [0, 0, 0, 0] for d in sorted_dets], dtype=np.float32).reshape(-1, 4)
+            track_boxes = np.array([track_bbox[tid] for tid in iou_track_ids], dtype=np.float32).reshape(-1, 4)
+            det_areas = (det_boxes[:, 2] - det_boxes[:, 0]) * (det_boxes[:, 3] - det_boxes[:, 1])
+            track_areas = (track_boxes[:, 2] - track_boxes[:, 0]) * (track_boxes[:, 3] - track_boxes[:, 1])
+            size_ratio = np.minimum(det_areas[:, None], track_areas[None, :]) / (np.maximum(det_areas[:, None], track_areas[None, :]) + 1e-6)
+            # Combined score considering IoU and size consistency
+            iou_scores = _iou_matrix(det_boxes, track_boxes) * (0.5 + 0.5 * size_ratio)
+        
+        for det_idx, det in enumerate(sorted_dets):
             bbox = det.get("bbox")
-            if not bbox or len(bbox) != 4: 
+            if bbox is None or len(bbox) != 4: 
                 continue
-            emb = det.get("embedding")
+            # Callers may pass raw embeddings; one dot product keeps the comparisons cosines
+            emb = normalize_face_embedding(det.get("embedding"))
             best_id = None
-            best_score = sim_thresh
+            sims = None
 
-            # Normalize embedding for better comparison
             if emb is not None:
-                emb = normalize_face_embedding(emb)
-                
-                # Find best matching track using multiple metrics
-                for tid, emb_list in track_embeddings.items():
-                    if tid in used_ids_in_this_frame: 
-                        continue
-                    
-                    # Calculate similarity with all embeddings in track
-                    similarities = [_cosine_sim(emb, prev_emb) for prev_emb in emb_list]
-                    max_sim = max(similarities) if similarities else 0.0
-                    avg_sim = np.mean(similarities) if similarities else 0.0
-                    
-                    # Weighted combination of max and average similarity
-                    combined_sim = 0.7 * max_sim + 0.3 * avg_sim
-                    
-                    # Add bonus for track quality
-                    quality_bonus = track_quality_scores.get(tid, 0.0) * 0.1
-                    final_score = combined_sim + quality_bonus
-                    
-                    if final_score > best_score:
-                        best_score = final_score
-                        best_id = tid
+                if emb_track_ids:
+                    # Cosine similarity against every stored embedding of every track in one GEMV
+                    sims = emb_matrix @ emb
+                    # Weighted max/average similarity per track, plus a bonus for track quality
+                    final_scores = _combine_track_sims(sims, emb_owner, len(emb_track_ids)) + emb_quality * 0.1
+                    if used_ids_in_this_frame:
+                        for col, tid in enumerate(emb_track_ids):
+                            if tid in used_ids_in_this_frame:
+                                final_scores[col] = -np.inf
+                    col = int(np.argmax(final_scores))
+                    if final_scores[col] > sim_thresh:
+                        best_id = emb_track_ids[col]
             
             # Enhanced IoU fallback with size consistency check
-            if best_id is None and track_bbox:
-                best_iou = 0.4  # Slightly higher threshold
-                for tid, prev_bbox in track_bbox.items():
-                    if tid in used_ids_in_this_frame: 
-                        continue
-                    
-                    iou = iou_box(bbox, prev_bbox)
-                    
-                    # Check size consistency
-                    prev_area = (prev_bbox[2] - prev_bbox[0]) * (prev_bbox[3] - prev_bbox[1])
-                    curr_area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
-                    size_ratio = min(curr_area, prev_area) / (max(curr_area, prev_area) + 1e-6)
-                    
-                    # Combined score considering IoU and size consistency
-                    combined_score = iou * (0.5 + 0.5 * size_ratio)
-                    
-                    if combined_score > best_iou:
-                        best_iou = combined_score
-                        best_id = tid
+            if best_id is None and iou_scores is not None:
+                scores = iou_scores[det_idx]
+                if used_ids_in_this_frame:
+                    scores = scores.copy()
+                    for col, tid in enumerate(iou_track_ids):
+                        if tid in used_ids_in_this_frame:
+                            scores[col] = -1.0
+                col = int(np.argmax(scores))
+                if scores[col] > 0.4:  # Slightly higher threshold
+                    best_id = iou_track_ids[col]
             
             if best_id is None:
                 best_id = next_id
@@ -651,12 +979,11 @@ def assign_track_ids_embedding(detections_per_frame, sim_thresh=QUALITY_THRESHOL
                 if best_id not in track_embeddings: 
                     track_embeddings[best_id] = []
                 
-                # Add embedding only if it's sufficiently different from existing ones
+                # Add embedding only if it's sufficiently different from existing ones;
+                # best_id is untouched earlier in this frame, so its snapshot rows are current
                 should_add = True
-                for existing_emb in track_embeddings[best_id]:
-                    if _cosine_sim(emb, existing_emb) > 0.9:  # Higher threshold
-                        should_add = False
-                        break
+                if sims is not None and best_id in emb_track_ids:
+                    should_add = not (sims[emb_owner == emb_track_ids.index(best_id)] > 0.9).any()  # Higher threshold
                 
                 if should_add and len(track_embeddings[best_id]) < MAX_EMBEDDINGS_PER_TRACK:
                     track_embeddings[best_id].append(emb)
@@ -704,6 +1031,34 @@ class SwapRequest(BaseModel):
     temporal_smoothing: bool = True  # Apply temporal smoothing
     quality_mode: str = "balanced"  # "fast", "balanced", "best"
 
+@app.on_event("startup")
+def prewarm_models():
+    """Load the default detector and swapper and run each once on dummy input.
+
+    This moves CUDA context creation, session init and the cuDNN algorithm search
+    out of the first user request. Failures are logged; models then load lazily.
+    """
+    if not PREWARM_MODELS:
+        return
+    try:
+        from insightface.app.common import Face
+        from insightface.utils import face_align
+        
+        logger.info("Pre-warming face models...")
+        dummy = np.zeros((256, 256, 3), dtype=np.uint8)
+        # Defaults of DetectFacesRequest / SwapRequest: HD detection in balanced mode
+        get_face_app_hd(FACE_MODULES).get(dummy)
+        # The detector finds nothing in a blank frame, so give the swapper a synthetic face
+        face = Face(kps=face_align.arcface_dst + 64, embedding=np.ones(512, dtype=np.float32))
+        get_swapper().get(dummy, face, face, paste_back=True)
+        logger.info("Face models ready.")
+    except Exception as e:
+        logger.warning(f"Model pre-warm failed, models will load on first request: {e}")
+
+@app.on_event("startup")
+def start_keyframe_cleanup():
+    threading.Thread(target=_prune_keyframes_worker, daemon=True).start()
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -715,8 +1070,244 @@ def get_progress(job_id: str):
         raise HTTPException(status_code=404, detail="Job not found")
     return job
 
+def _det_accepts_any_size(face_app) -> bool:
+    """Whether the detector graph has dynamic spatial dims, so it can run at ROI_DET_SIZE."""
+    shape = face_app.det_model.session.get_inputs()[0].shape
+    return not isinstance(shape[2], int) and not isinstance(shape[3], int)
+
+
+def _detect_faces_in_roi(face_app, frame, bbox, reuse_embedding=None):
+    """Detect faces in a padded crop around bbox and return them in frame coordinates.
+
+    Detector cost follows its input size, not the crop's, so running at ROI_DET_SIZE is several
+    times cheaper than a full-frame pass at det_size. Recognition still runs on the full frame,
+    except when a single face overlaps bbox by ROI_REUSE_IOU: it takes reuse_embedding instead.
+    """
+    from insightface.app.common import Face
+    h, w = frame.shape[:2]
+    x1, y1, x2, y2 = [int(v) for v in bbox]
+    pad = int(max(x2 - x1, y2 - y1) * ROI_PAD)
+    cx1, cy1, cx2, cy2 = max(0, x1 - pad), max(0, y1 - pad), min(w, x2 + pad), min(h, y2 + pad)
+    if cx2 - cx1 < 32 or cy2 - cy1 < 32:
+        return []
+    bboxes, kpss = face_app.det_model.detect(frame[cy1:cy2, cx1:cx2], input_size=(ROI_DET_SIZE, ROI_DET_SIZE),
+                                             max_num=0, metric="default")
+    if kpss is None:
+        return []
+    offset = np.array([cx1, cy1], dtype=np.float32)
+    faces = []
+    for i in range(bboxes.shape[0]):
+        face = Face(bbox=bboxes[i, 0:4] + np.tile(offset, 2), kps=kpss[i] + offset, det_score=bboxes[i, 4])
+        if (reuse_embedding is not None and bboxes.shape[0] == 1
+                and _iou_matrix(face.bbox, bbox)[0, 0] >= ROI_REUSE_IOU):
+            # Same place as last frame's target with nobody else nearby: same face, skip ArcFace
+            face.embedding = reuse_embedding
+            face.embedding_reused = True
+            faces.append(face)
+            continue
+        for taskname, model in face_app.models.items():
+            if taskname != "detection":
+                model.get(frame, face)
+        faces.append(face)
+    return faces
+
+
+def _contains_identity(faces, unit_embedding, threshold) -> bool:
+    """Whether any face's embedding has cosine similarity >= threshold with unit_embedding."""
+    for face in faces:
+        emb = _face_unit_embedding(face)
+        if emb is not None and _cosine_sim_prenorm(emb, unit_embedding) >= threshold:
+            return True
+    return False
+
+
+def _display_size(cap):
+    """Frame size of a VideoCapture's stream as decoded, i.e. after FFmpeg's auto-rotation.
+
+    With auto-orientation on (the default), OpenCV already reports the rotated width/height,
+    which is also what FFmpeg's rawvideo output uses; swapping them again would undo it.
+    """
+    return int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+
+class _FFmpegFrameReader:
+    """VideoCapture-like reader that decodes through FFmpeg into BGR frames.
+
+    With hwaccel="cuda" decoding runs on NVDEC (check _nvdec_available first). FFmpeg only falls
+    back to software decoding itself when the hwaccel exists but can't start for this stream;
+    if FFmpeg yields no frame at all, the reader logs its error and switches to cv2.VideoCapture.
+    """
+
+    def __init__(self, video_path, width, height, hwaccel=None):
+        self.width, self.height = width, height
+        self._video_path = str(video_path)
+        self._frames = 0
+        self._fallback = None
+        # A file rather than a pipe, so a chatty decoder can't block on unread stderr
+        self._log = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen([
+            "ffmpeg", "-loglevel", "error", *(["-hwaccel", hwaccel] if hwaccel else []),
+            "-i", str(video_path),
+            # Every decoded frame once, like VideoCapture.read; no audio/subtitle decoding
+            "-map", "0:v:0", "-vsync", "passthrough", "-an", "-sn",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"
+        ], stdout=subprocess.PIPE, stderr=self._log)
+
+    def read(self, image=None):
+        if self._fallback is not None:
+            return self._fallback.read(image) if image is not None else self._fallback.read()
+        if image is None or image.shape != (self.height, self.width, 3):
+            image = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        view = memoryview(image).cast("B")
+        got = 0
+        while got < len(view):
+            n = self._proc.stdout.readinto(view[got:])
+            if not n:
+                return self._ended(image)
+            got += n
+        self._frames += 1
+        return True, image
+
+    def _ended(self, image):
+        """FFmpeg's output ended: log why if it failed, and fall back to OpenCV if it produced nothing."""
+        code = self._proc.wait()
+        if code != 0:
+            self._log.seek(0)
+            err = self._log.read().decode(errors="replace").strip()
+            print(f"FFmpeg decode exited with {code} after {self._frames} frames: {err}")
+        if self._frames:
+            return False, None
+        print("FFmpeg decoded no frames, falling back to OpenCV")
+        self._fallback = cv2.VideoCapture(self._video_path)
+        return self._fallback.read(image)
+
+    def release(self):
+        self._proc.stdout.close()
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+        self._log.close()
+        if self._fallback is not None:
+            self._fallback.release()
+
+
+def _decode_sampled_frames(video_path, width, height, interval_frames, max_frames):
+    """Yield every interval_frames-th frame (BGR, from frame 0) using a single FFmpeg decode pass."""
+    proc = subprocess.Popen([
+        "ffmpeg", "-loglevel", "error", "-hwaccel", "auto",
+        "-i", str(video_path),
+        "-vf", f"select='not(mod(n\\,{interval_frames}))'", "-vsync", "vfr",
+        "-frames:v", str(max_frames),
+        "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    frame_size = width * height * 3
+    try:
+        while True:
+            buf = proc.stdout.read(frame_size)
+            if len(buf) < frame_size:
+                break
+            yield np.frombuffer(buf, dtype=np.uint8).reshape(height, width, 3)
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+
+def _encode_keyframe_thumbnail(frame) -> bytes:
+    """JPEG thumbnail of a BGR keyframe for the character picker.
+
+    Face bboxes stay in full-frame pixels; the UI positions them relative to the
+    keyframe's reported width/height, so the thumbnail can be smaller.
+    """
+    h, w = frame.shape[:2]
+    scale = KEYFRAME_THUMB_MAX / max(h, w)
+    if scale < 1.0:
+        frame = cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    _, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), KEYFRAME_JPEG_QUALITY])
+    return buf.tobytes()
+
+
+def _prune_keyframe_dirs():
+    """Remove keyframe batches older than KEYFRAMES_TTL_SECONDS."""
+    cutoff = time.time() - KEYFRAMES_TTL_SECONDS
+    for d in KEYFRAMES_DIR.iterdir():
+        try:
+            if d.is_dir() and d.stat().st_mtime < cutoff:
+                shutil.rmtree(d, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def _prune_keyframes_worker():
+    while True:
+        _prune_keyframe_dirs()
+        time.sleep(KEYFRAMES_TTL_SECONDS / 4)
+
+
+def _detect_keyframe_faces(face_app, frame, quality_mode):
+    """Run only the detector on one BGR keyframe.
+
+    Returns (image the faces were found in, faces without embeddings); recognition runs
+    afterwards over all keyframes at once in _embed_faces_batched.
+    """
+    from insightface.app.common import Face
+    # InsightFace takes BGR directly, the same as the swap loop, so track embeddings match
+    img = frame
+    
+    # Apply preprocessing for better detection
+    if quality_mode == "best":
+        # Enhance image before detection
+        img = apply_post_processing(img)
+    
+    # Same as FaceAnalysis.get up to the per-face models
+    bboxes, kpss = face_app.det_model.detect(img, max_num=0, metric="default")
+    faces = [Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+             for i in range(bboxes.shape[0])]
+    return img, faces
+
+def _embed_faces_batched(rec_model, items):
+    """Set .embedding on each (img, face) with ArcFace runs of up to REC_BATCH_SIZE aligned crops."""
+    from insightface.utils import face_align
+    crops = [face_align.norm_crop(img, landmark=face.kps, image_size=rec_model.input_size[0]) for img, face in items]
+    # Models exported with a fixed batch dimension take one crop per run
+    batch = 1 if isinstance(rec_model.input_shape[0], int) else REC_BATCH_SIZE
+    for start in range(0, len(crops), batch):
+        feats = rec_model.get_feat(crops[start:start + batch])
+        for (_, face), feat in zip(items[start:start + batch], feats):
+            face.embedding = feat.flatten()
+
+def _keyframe_detections(faces):
+    """Detections ready for track assignment from one keyframe's faces."""
+    frame_dets = []
+    for f in faces:
+        # ndarray until the JSON response; assign_track_ids_embedding stacks these for IoU
+        bbox = f.bbox.astype(np.int32)
+        emb = _face_unit_embedding(f)
+        
+        # Calculate quality score based on face properties
+        det_score = float(getattr(f, "det_score", 0.0) or 0.0)
+        face_area = int((bbox[2] - bbox[0]) * (bbox[3] - bbox[1]))
+        quality_score = det_score * (1.0 + np.log10(max(face_area, 1)) / 10.0)
+        
+        det = {
+            "bbox": bbox,
+            "quality_score": quality_score
+        }
+        
+        if emb is not None:
+            det["embedding"] = emb
+        
+        frame_dets.append(det)
+    return frame_dets
+
 @app.post("/detect-faces")
-def detect_faces(req: DetectFacesRequest = Body(...)):
+def detect_faces(req: DetectFacesRequest = Body(...), embed: bool = False):
+    """Detect and track faces on sampled keyframes.
+
+    Keyframe thumbnails are written as JPEG files and returned as ``imageUrl``
+    (relative to this service); pass ``?embed=1`` for inline ``imageBase64`` data URLs.
+    """
     try:
         _apply_use_cuda(req.use_cuda)
         video_path = req.video_path
@@ -726,6 +1317,7 @@ def detect_faces(req: DetectFacesRequest = Body(...)):
         cap = cv2.VideoCapture(video_path)
         fps = cap.get(cv2.CAP_PROP_FPS) or 30
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width, height = _display_size(cap)
         cap.release()
 
         # Adjust sampling based on quality mode
@@ -745,76 +1337,58 @@ def detect_faces(req: DetectFacesRequest = Body(...)):
         
         # Choose detection model based on quality requirements
         if req.use_hd_detection and req.quality_mode in ["balanced", "best"]:
-            face_app = get_face_app_hd()
+            face_app = get_face_app_hd(FACE_MODULES)
             logger.info("Using HD face detection.")
         else:
-            face_app = get_face_app()
+            face_app = get_face_app(FACE_MODULES)
             logger.info("Using standard face detection.")
         
-        raw_per_frame = []
         stored_frames = []
         keyframes_meta = []
 
-        cap = cv2.VideoCapture(video_path)
-        for idx in frame_indices:
-            logger.info(f"Reading frame {idx}...")
-            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-            ret, frame = cap.read()
-            if not ret: 
-                logger.warning(f"Failed to read frame {idx}")
-                continue
-            
+        # Decode every sampled frame first so detection can run over them concurrently.
+        # One FFmpeg pass keeps every interval_frames-th frame in stream order, instead of
+        # a VideoCapture seek (and GOP re-decode) per keyframe.
+        for idx, frame in zip(frame_indices, _decode_sampled_frames(video_path, width, height, interval_frames, len(frame_indices))):
             stored_frames.append(frame)
-            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
-            # Apply preprocessing for better detection
-            if req.quality_mode == "best":
-                # Enhance image before detection
-                rgb = apply_post_processing(rgb)
-            
-            faces = face_app.get(rgb)
-            logger.info(f"Found {len(faces)} faces in frame {idx}")
-            
-            frame_dets = []
-            for f in faces:
-                bbox = f.bbox.astype(int).tolist()
-                emb = getattr(f, "normed_embedding", getattr(f, "embedding", None))
-                
-                # Calculate quality score based on face properties
-                det_score = float(getattr(f, "det_score", 0.0) or 0.0)
-                face_area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) if len(bbox) == 4 else 0
-                quality_score = det_score * (1.0 + np.log10(max(face_area, 1)) / 10.0)
-                
-                det = {
-                    "bbox": bbox,
-                    "quality_score": quality_score
-                }
-                
-                if emb is not None:
-                    det["embedding"] = normalize_face_embedding(np.asarray(emb, dtype=np.float32))
-                
-                frame_dets.append(det)
-            
-            raw_per_frame.append(frame_dets)
-            h, w = frame.shape[:2]
-            keyframes_meta.append({"frameIndex": idx, "time": round(idx/fps, 2), "width": w, "height": h})
-        
-        cap.release()
+            keyframes_meta.append({"frameIndex": idx, "time": round(idx/fps, 2), "width": width, "height": height})
+        if len(stored_frames) < len(frame_indices):
+            logger.warning(f"Decoded {len(stored_frames)} of {len(frame_indices)} sampled frames")
+
+        # ONNX Runtime releases the GIL during inference, so concurrent workers keep the GPU fed
+        # while another thread does pre/post-processing; map() keeps frame order
+        with ThreadPoolExecutor(max_workers=DETECT_WORKERS) as pool:
+            detected = list(pool.map(lambda frame: _detect_keyframe_faces(face_app, frame, req.quality_mode), stored_frames))
+        # ArcFace over every keyframe face in a few batched runs instead of one run per face
+        rec_model = face_app.models.get("recognition")
+        if rec_model is not None:
+            _embed_faces_batched(rec_model, [(img, f) for img, faces in detected for f in faces if f.kps is not None])
+        raw_per_frame = [_keyframe_detections(faces) for _, faces in detected]
+        for kf, frame_dets in zip(keyframes_meta, raw_per_frame):
+            logger.info(f"Found {len(frame_dets)} faces in frame {kf['frameIndex']}")
 
         logger.info("Assigning track IDs with enhanced algorithm...")
         with_tracks, track_embeddings = assign_track_ids_embedding(raw_per_frame)
         
         logger.info("Encoding keyframes...")
         keyframes = []
+        batch_id = uuid.uuid4().hex
+        batch_dir = KEYFRAMES_DIR / batch_id
+        if not embed:
+            batch_dir.mkdir(parents=True, exist_ok=True)
         for i, frame_dets in enumerate(with_tracks):
             kf = keyframes_meta[i]
             kf["faces"] = [{
-                "bbox": d["bbox"], 
+                "bbox": np.asarray(d["bbox"]).tolist(), 
                 "trackId": d["trackId"],
                 "quality": d.get("quality_score", 0.0)
             } for d in frame_dets]
-            _, buf = cv2.imencode(".png", stored_frames[i])
-            kf["imageBase64"] = "data:image/png;base64," + base64.b64encode(buf.tobytes()).decode("utf-8")
+            thumb = _encode_keyframe_thumbnail(stored_frames[i])
+            if embed:
+                kf["imageBase64"] = "data:image/jpeg;base64," + base64.b64encode(thumb).decode("utf-8")
+            else:
+                (batch_dir / f"{i}.jpg").write_bytes(thumb)
+                kf["imageUrl"] = f"/keyframes/{batch_id}/{i}.jpg"
             keyframes.append(kf)
 
         logger.info("Face detection complete with enhanced quality.")
@@ -837,8 +1411,149 @@ def swap(background_tasks: BackgroundTasks, req: SwapRequest = Body(...)):
     background_tasks.add_task(_do_swap, job_id, req)
     return {"jobId": job_id, "status": "queued"}
 
+def _has_cuda() -> bool:
+    """Whether this request's models run on CUDA (so NVENC is worth trying)."""
+    if "CUDAExecutionProvider" not in _get_providers():
+        return False
+    if torch is not None:
+        return torch.cuda.is_available()
+    return True
+
+
+@functools.lru_cache(maxsize=1)
+def _nvdec_available() -> bool:
+    """Whether the local FFmpeg build has the cuda hwaccel (probed once).
+
+    Builds without it reject `-hwaccel cuda` outright instead of decoding in software.
+    """
+    try:
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-hwaccels"], capture_output=True, text=True, timeout=10)
+        return result.returncode == 0 and "cuda" in result.stdout.split()
+    except Exception:
+        return False
+
+
+@functools.lru_cache(maxsize=1)
+def _nvenc_available() -> bool:
+    """Whether h264_nvenc can actually encode here (probed once with a one-frame test encode).
+
+    Listing the encoder in `ffmpeg -encoders` only means FFmpeg was built with it; the
+    driver or a free NVENC session may still be missing, and the frames piped into a
+    failed encoder can't be replayed into a libx264 fallback.
+    """
+    try:
+        result = subprocess.run([
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-f", "lavfi", "-i", "color=c=black:s=256x256:r=1", "-frames:v", "1",
+            "-c:v", "h264_nvenc", "-f", "null", "-"
+        ], capture_output=True, timeout=20)
+        return result.returncode == 0
+    except Exception:
+        return False
+
+
+def _swap_codec_args(quality_mode: str, use_nvenc: bool = False) -> list[str]:
+    """Video codec settings for the swapped video, by quality mode, on NVENC or libx264."""
+    if use_nvenc:
+        # Motion estimation and entropy coding move onto the GPU's NVENC block
+        presets = {"best": ("p7", "18"), "fast": ("p3", "28")}
+        preset, cq = presets.get(quality_mode, ("p4", "23"))
+        return ["-c:v", "h264_nvenc", "-preset", preset, "-rc", "vbr", "-cq", cq, "-b:v", "0"]
+    if quality_mode == "best":
+        crf_value = "18"  # Higher quality
+        preset = "slow"
+    elif quality_mode == "fast":
+        crf_value = "28"  # Lower quality, faster
+        preset = "veryfast"
+    else:  # balanced
+        crf_value = "23"
+        preset = "fast"
+    return ["-c:v", "libx264", "-preset", preset, "-crf", crf_value]
+
+
+def _open_swap_encoder(out_video_path, video_path, width, height, fps, codec_args, log_file):
+    """Start FFmpeg reading raw BGR frames from stdin, muxing audio from the source video."""
+    return subprocess.Popen([
+        "ffmpeg", "-y",
+        "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-framerate", str(fps), "-i", "pipe:0",
+        "-i", str(video_path), "-map", "0:v", "-map", "1:a?",
+        *codec_args,
+        "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest",
+        str(out_video_path)
+    ], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log_file)
+
+
+def _queue_put(q, item, stop):
+    """Put into a bounded queue, giving up once `stop` is set so a producer never blocks on a dead consumer."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _queue_get(q, stop):
+    """Get from a queue, returning None (the end-of-stream sentinel) once `stop` is set."""
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return None
+
+
+def _read_frames_worker(cap, frame_queue, stop, errors):
+    """Pipeline stage: decode frames from the VideoCapture (or _FFmpegFrameReader) into frame_queue, then a None sentinel.
+
+    Frames are decoded into a ring of reused buffers. A frame is at most in the frame queue,
+    the swap loop, the output queue or the writer, so after 2 * SWAP_QUEUE_SIZE + 3 reads its
+    buffer is free again.
+    """
+    ring = [None] * (2 * SWAP_QUEUE_SIZE + 3)
+    try:
+        i = 0
+        while not stop.is_set():
+            buf = ring[i]
+            # OpenCV decodes in place when the buffer already has the frame's shape
+            ret, frame = cap.read(buf) if buf is not None else cap.read()
+            if not ret:
+                break
+            ring[i] = frame
+            i = (i + 1) % len(ring)
+            if not _queue_put(frame_queue, frame, stop):
+                break
+    except Exception as e:
+        errors.append(e)
+    finally:
+        _queue_put(frame_queue, None, stop)
+
+
+def _write_frames_worker(encoder, output_queue, stop, errors):
+    """Pipeline stage: write swapped BGR frames from output_queue to the FFmpeg encoder."""
+    try:
+        while True:
+            frame = _queue_get(output_queue, stop)
+            if frame is None:
+                break
+            encoder.stdin.write(np.ascontiguousarray(frame).data)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+
+
 def _do_swap(job_id: str, req: SwapRequest):
-    frames_dir = None
+    encoder = None
+    cap = None
+    # Decode, swap and encode run concurrently: a reader thread prefetches frames, this thread
+    # detects and swaps, and a writer thread feeds FFmpeg. OpenCV, ONNX Runtime and pipe
+    # writes all release the GIL, so the stages overlap.
+    stop = threading.Event()
+    errors = []
+    workers = []
+    # FFmpeg's log is spooled to disk so an unread stderr pipe can't stall the encode
+    encoder_log = tempfile.TemporaryFile()
     face_history = []  # For temporal smoothing
     try:
         _apply_use_cuda(req.use_cuda)
@@ -847,10 +1562,10 @@ def _do_swap(job_id: str, req: SwapRequest):
         
         # Choose appropriate face detection model based on quality settings
         if req.use_hd_detection and req.quality_mode in ["balanced", "best"]:
-            face_app = get_face_app_hd()
+            face_app = get_face_app_hd(FACE_MODULES)
             print(f"Using HD face detection for job {job_id}")
         else:
-            face_app = get_face_app()
+            face_app = get_face_app(FACE_MODULES)
             print(f"Using standard face detection for job {job_id}")
         
         swapper = get_swapper()
@@ -861,30 +1576,30 @@ def _do_swap(job_id: str, req: SwapRequest):
             update_job_progress(job_id, 0, "failed", {"error": "Source image not readable"})
             return
 
-        src_rgb = cv2.cvtColor(src_img, cv2.COLOR_BGR2RGB)
-        src_faces = face_app.get(src_rgb)
+        # InsightFace works on BGR images as read by OpenCV
+        src_faces = face_app.get(src_img)
 
         if not src_faces:
             print(f"[{job_id}] No face found with primary detector. Trying fallback detector...")
             try:
-                fallback_app = get_face_app()
-                src_faces = fallback_app.get(src_rgb)
+                fallback_app = get_face_app(FACE_MODULES)
+                src_faces = fallback_app.get(src_img)
             except Exception as e:
                 print(f"[{job_id}] Fallback detector failed: {e}")
 
         if not src_faces:
             # If the source is small, upscale and retry once
-            h, w = src_rgb.shape[:2]
+            h, w = src_img.shape[:2]
             min_dim = min(h, w)
             if min_dim < 320:
                 scale = 640 / max(1, min_dim)
                 new_size = (int(w * scale), int(h * scale))
                 print(f"[{job_id}] Upscaling source image to {new_size} for detection")
-                up_rgb = cv2.resize(src_rgb, new_size, interpolation=cv2.INTER_CUBIC)
+                up_img = cv2.resize(src_img, new_size, interpolation=cv2.INTER_CUBIC)
                 try:
-                    src_faces = face_app.get(up_rgb)
+                    src_faces = face_app.get(up_img)
                     if not src_faces:
-                        src_faces = get_face_app().get(up_rgb)
+                        src_faces = get_face_app(FACE_MODULES).get(up_img)
                 except Exception as e:
                     print(f"[{job_id}] Upscaled detection failed: {e}")
 
@@ -922,7 +1637,7 @@ def _do_swap(job_id: str, req: SwapRequest):
             # Extract and align source face for better swapping
             try:
                 x1, y1, x2, y2 = source_face.bbox.astype(int)
-                src_face_crop = src_rgb[y1:y2, x1:x2]
+                src_face_crop = src_img[y1:y2, x1:x2]
                 src_face_crop = enhance_face_alignment(src_face_crop)
                 print(f"Enhanced source face alignment for job {job_id}")
             except Exception as e:
@@ -931,16 +1646,23 @@ def _do_swap(job_id: str, req: SwapRequest):
         cap = cv2.VideoCapture(video_path)
         fps = cap.get(cv2.CAP_PROP_FPS) or 30
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if HW_DECODE and _has_cuda() and _nvdec_available():
+            width, height = _display_size(cap)
+            cap.release()
+            cap = _FFmpegFrameReader(video_path, width, height, hwaccel="cuda")
+            print(f"[{job_id}] Decoding with FFmpeg -hwaccel cuda")
         out_id = str(uuid.uuid4())
-        frames_dir = Path(TEMP_DIR) / f"morph_frames_{out_id}"
-        frames_dir.mkdir(parents=True, exist_ok=True)
         out_video_path = Path(TEMP_DIR) / f"morph_out_{out_id}.mp4"
+        codec_args = _swap_codec_args(req.quality_mode, _has_cuda() and _nvenc_available())
+        print(f"[{job_id}] Encoding with {' '.join(codec_args)}")
 
-        track_embeddings = {}
+        track_bank = _TrackEmbeddingBank(per_track=8)  # Increased capacity
         target_embedding = None
         if req.target_face_embedding:
             target_embedding = normalize_face_embedding(np.array(req.target_face_embedding, dtype=np.float32))
-            track_embeddings[target_track_id] = [target_embedding]
+            track_bank.add(target_track_id, target_embedding)
+        # New tracks take ids above the seeded target track; ids are never reused
+        next_id = max(track_bank.track_ids, default=-1) + 1
 
         track_bbox = {}
         # Enhanced similarity thresholds based on quality mode
@@ -965,35 +1687,82 @@ def _do_swap(job_id: str, req: SwapRequest):
             min_face_area = 60 * 60
             min_det_score = 0.3
 
+        # "best" always re-detects; the other modes may reuse detections across static frames
+        motion_gate = req.quality_mode != "best"
+        prev_faces = None
+        prev_small = None
+        frames_since_detect = 0
+        # Between full-frame passes, moving frames re-detect only around where the target was last swapped.
+        # Needs the target embedding to confirm the ROI still holds the target; else the frame gets a full pass.
+        roi_detect = motion_gate and target_embedding is not None and _det_accepts_any_size(face_app)
+        last_target_bbox = None
+        last_target_embedding = None
+        roi_detections = 0
+
         frame_idx = 0
         update_job_progress(job_id, 0, "processing")
         print(f"[{job_id}] Starting face swap processing for {total_frames} frames...")
 
+        frame_queue = queue.Queue(maxsize=SWAP_QUEUE_SIZE)
+        output_queue = queue.Queue(maxsize=SWAP_QUEUE_SIZE)
+        workers.append(threading.Thread(target=_read_frames_worker, args=(cap, frame_queue, stop, errors), daemon=True))
+        workers[0].start()
+
         while True:
-            ret, frame = cap.read()
-            if not ret: 
+            frame = _queue_get(frame_queue, stop)
+            if frame is None: 
                 break
             
+            if encoder is None:
+                # Sized from the first decoded frame, which already has any rotation applied
+                h, w = frame.shape[:2]
+                encoder = _open_swap_encoder(out_video_path, video_path, w, h, fps, codec_args, encoder_log)
+                workers.append(threading.Thread(target=_write_frames_worker, args=(encoder, output_queue, stop, errors), daemon=True))
+                workers[1].start()
+            
             try:
                 # Progress update for very first frame
                 if frame_idx == 0:
                     print(f"[{job_id}] Processing first frame...")
                     update_job_progress(job_id, 1, "processing")
                 
-                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                
-                # Detect faces directly - no preprocessing to avoid artifacts
-                faces = face_app.get(rgb)
+                # Motion gate: on a near-static frame reuse the last detections instead of
+                # running the detector; re-detect at least every MOTION_GATE_MAX_SKIP frames
+                # Downscale before the gray conversion so it touches 64x64 pixels, not the full frame
+                small = cv2.cvtColor(cv2.resize(frame, (64, 64), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+                motion = cv2.absdiff(small, prev_small).mean() if prev_small is not None else None
+                if (motion_gate and prev_faces is not None and frames_since_detect < MOTION_GATE_MAX_SKIP
+                        and motion < MOTION_GATE_THRESHOLD):
+                    faces = prev_faces
+                    frames_since_detect += 1
+                    detections_reused = True
+                else:
+                    detections_reused = False
+                    faces = None
+                    if roi_detect and last_target_bbox is not None and roi_detections < ROI_DETECT_MAX_FRAMES:
+                        # After a large change (e.g. a scene cut) the face in the ROI must be re-identified
+                        reuse = last_target_embedding if motion is not None and motion < ROI_REUSE_MAX_MOTION else None
+                        faces = _detect_faces_in_roi(face_app, frame, last_target_bbox, reuse)
+                        if not _contains_identity(faces, target_embedding, TARGET_SIM_THRESH):
+                            faces = None
+                    if faces is None:
+                        # Detect faces directly on the decoded BGR frame - no preprocessing to avoid artifacts
+                        faces = face_app.get(frame)
+                        roi_detections = 0
+                    else:
+                        roi_detections += 1
+                    prev_faces, prev_small, frames_since_detect = faces, small, 0
                 
                 frame_dets = []
-                for f in faces:
+                # Boxes stay an int32 ndarray (one row per face) through tracking and swapping
+                boxes = np.stack([f.bbox for f in faces]).astype(np.int32) if len(faces) else np.empty((0, 4), np.int32)
+                face_areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+                for f, bbox, face_area in zip(faces, boxes, face_areas):
                     try:
-                        bbox = f.bbox.astype(int).tolist()
-                        emb = getattr(f, "normed_embedding", getattr(f, "embedding", None))
+                        emb = _face_unit_embedding(f)
                         
                         # Calculate quality metrics
                         det_score = float(getattr(f, "det_score", 0.0) or 0.0)
-                        face_area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) if len(bbox) == 4 else 0
                         if face_area < min_face_area or det_score < min_det_score:
                             continue
                         quality_score = det_score * (1.0 + np.log10(max(face_area, 1)) / 10.0)
@@ -1001,7 +1770,8 @@ def _do_swap(job_id: str, req: SwapRequest):
                         det = {
                             "face": f, 
                             "bbox": bbox, 
-                            "embedding": normalize_face_embedding(np.asarray(emb, dtype=np.float32)) if emb is not None else None,
+                            "embedding": emb,
+                            "embedding_reused": bool(getattr(f, "embedding_reused", False)),
                             "quality_score": quality_score
                         }
                         frame_dets.append(det)
@@ -1017,7 +1787,7 @@ def _do_swap(job_id: str, req: SwapRequest):
                     for det in frame_dets:
                         if det["embedding"] is None:
                             continue
-                        sim = _cosine_sim(det["embedding"], target_embedding)
+                        sim = _cosine_sim_prenorm(det["embedding"], target_embedding)
                         
                         # Weight similarity by face quality
                         weighted_sim = sim * (0.7 + 0.3 * min(1.0, det["quality_score"]))
@@ -1029,67 +1799,70 @@ def _do_swap(job_id: str, req: SwapRequest):
                     if target_score is None or target_score < TARGET_SIM_THRESH:
                         target_det = None
 
-                # Enhanced tracking with quality considerations
+                # Enhanced tracking with quality considerations.
+                # Embeddings added during this frame belong to tracks already in used_ids, so they are masked out.
+                # The common single-face frame skips the sort and the masking.
                 used_ids = set()
-                for det in sorted(frame_dets, key=lambda d: (
+                ordered_dets = frame_dets if len(frame_dets) < 2 else sorted(frame_dets, key=lambda d: (
                     d["embedding"] is not None,
                     d["quality_score"]
-                ), reverse=True):
+                ), reverse=True)
+                for det in ordered_dets:
                     bbox, emb = det["bbox"], det["embedding"]
-                    best_id, best_score = None, SIM_THRESH
+                    best_id = None
                     
-                    if emb is not None:
-                        for tid, embs in track_embeddings.items():
-                            if tid in used_ids: 
-                                continue
-                            
-                            # Calculate weighted similarity considering track history
-                            similarities = [_cosine_sim(emb, te) for te in embs]
-                            if similarities:
-                                max_sim = max(similarities)
-                                avg_sim = np.mean(similarities)
-                                combined_sim = 0.7 * max_sim + 0.3 * avg_sim
-                                
-                                if combined_sim > best_score:
-                                    best_score, best_id = combined_sim, tid
+                    if emb is not None and track_bank.n:
+                        # Weighted similarity considering track history, all tracks in one GEMV
+                        combined_sims = track_bank.scores(emb)
+                        if used_ids:
+                            for col, tid in enumerate(track_bank.track_ids):
+                                if tid in used_ids:
+                                    combined_sims[col] = -np.inf
+                        col = int(np.argmax(combined_sims))
+                        if combined_sims[col] > SIM_THRESH:
+                            best_id = track_bank.track_ids[col]
                     
-                    # Enhanced IoU fallback
+                    # Enhanced IoU fallback: best-overlapping free track above the threshold
                     if best_id is None and track_bbox:
-                        for tid, last_box in track_bbox.items():
-                            if tid in used_ids: 
-                                continue
-                            iou = iou_box(bbox, last_box)
-                            if iou > 0.4:  # Higher threshold
-                                best_id = tid
-                                break
+                        free_ids = [tid for tid in track_bbox if tid not in used_ids] if used_ids else list(track_bbox)
+                        if free_ids:
+                            ious = _iou_matrix(bbox, np.stack([track_bbox[tid] for tid in free_ids]))[0]
+                            col = int(np.argmax(ious))
+                            if ious[col] > 0.4:  # Higher threshold
+                                best_id = free_ids[col]
                                 
                     if best_id is None:
-                        best_id = max(list(track_embeddings.keys()) + list(track_bbox.keys()) + [-1]) + 1
+                        best_id = next_id
+                        next_id += 1
                         
                     used_ids.add(best_id)
                     det["trackId"] = best_id
                     track_bbox[best_id] = bbox
                     
-                    if emb is not None:
-                        if best_id not in track_embeddings: 
-                            track_embeddings[best_id] = []
-                        if len(track_embeddings[best_id]) < 8:  # Increased capacity
-                            track_embeddings[best_id].append(emb)
+                    # Reused detections and carried-over embeddings are already in the bank;
+                    # adding them again would only fill the track's slots with copies
+                    if emb is not None and not detections_reused and not det["embedding_reused"]:
+                        track_bank.add(best_id, emb)
 
+                last_target_bbox = None
+                last_target_embedding = None
                 # Enhanced face swapping with multiple quality improvements
-                swapped_rgb = rgb.copy()
+                # swapper.get and soften_swap_edges return new images, so the decoded frame needs no copy
+                swapped = frame
                 
                 if target_det is not None:
                     try:
                         print(f"[{job_id}] Processing frame {frame_idx}: Found target face, swapping...")
                         
-                        orig_bbox = target_det["bbox"].copy() if isinstance(target_det["bbox"], np.ndarray) else target_det["bbox"][:]
+                        orig_bbox = target_det["bbox"]
+                        last_target_bbox = orig_bbox
+                        last_target_embedding = target_det["embedding"]
                         
                         # Let InsightFace handle the swap and paste
-                        swapped_rgb = swapper.get(rgb, target_det["face"], source_face, paste_back=True)
+                        swapped = swapper.get(frame, target_det["face"], source_face, paste_back=True)
                         
                         # Soften the edges of the pasted region to remove hard seams
-                        swapped_rgb = soften_swap_edges(rgb, swapped_rgb, orig_bbox)
+                        swapped = soften_swap_edges(frame, swapped, orig_bbox)
                                 
                     except Exception as e:
                         print(f"Face swap failed for frame {frame_idx}: {e}")
@@ -1102,10 +1875,11 @@ def _do_swap(job_id: str, req: SwapRequest):
                     for det in frame_dets:
                         if det["trackId"] == target_track_id:
                             try:
-                                orig_bbox = det["bbox"].copy() if isinstance(det["bbox"], np.ndarray) else det["bbox"][:]
+                                orig_bbox = det["bbox"]
+                                last_target_bbox = orig_bbox
                                 
-                                swapped_rgb = swapper.get(rgb, det["face"], source_face, paste_back=True)
-                                swapped_rgb = soften_swap_edges(rgb, swapped_rgb, orig_bbox)
+                                swapped = swapper.get(frame, det["face"], source_face, paste_back=True)
+                                swapped = soften_swap_edges(frame, swapped, orig_bbox)
                                         
                             except Exception as e:
                                 print(f"Track-based face swap failed for frame {frame_idx}: {e}")
@@ -1113,57 +1887,50 @@ def _do_swap(job_id: str, req: SwapRequest):
                                 traceback.print_exc()
                             break
                 
-                # Convert back to BGR and save
-                frame_out = cv2.cvtColor(swapped_rgb, cv2.COLOR_RGB2BGR)
-                cv2.imwrite(str(frames_dir / f"frame_{frame_idx:08d}.png"), frame_out)
-                frame_idx += 1
-                
-                # More frequent progress updates for better user feedback
-                if frame_idx % 5 == 0:  # Update every 5 frames instead of 25
-                    progress = (frame_idx / total_frames) * 95  # Reserve 5% for encoding
-                    print(f"[{job_id}] Frame {frame_idx}/{total_frames} ({progress:.1f}%) (Quality: {req.quality_mode})")
-                    update_job_progress(job_id, progress)
-                    
-                # Less frequent memory cleanup
-                if frame_idx % 50 == 0:
-                    import gc
-                    gc.collect()
-                    # Limit face history size during long processing
-                    if len(face_history) > TEMPORAL_SMOOTH_FRAMES:
-                        face_history = face_history[-TEMPORAL_SMOOTH_FRAMES:]
-            
             except Exception as e:
                 print(f"Frame processing failed for frame {frame_idx}: {e}")
                 import traceback
                 traceback.print_exc()
-                # Continue with next frame
-                frame_idx += 1
-                continue
-
-        cap.release()
+                # Keep the original frame so audio stays in sync, and continue with next frame
+                swapped = frame
+
+            # Already BGR; hand to the writer thread. Queued outside the try so each input frame
+            # yields exactly one output frame even if something below fails
+            if not _queue_put(output_queue, swapped, stop):
+                raise errors[0] if errors else RuntimeError("Encoder stopped")
+            frame_idx += 1
+            
+            # More frequent progress updates for better user feedback
+            if frame_idx % 5 == 0 and total_frames > 0:  # Update every 5 frames instead of 25
+                progress = min(95, (frame_idx / total_frames) * 95)  # Reserve 5% for encoding
+                print(f"[{job_id}] Frame {frame_idx}/{total_frames} ({progress:.1f}%) (Quality: {req.quality_mode})")
+                update_job_progress(job_id, progress)
+                
+            # Less frequent memory cleanup
+            if frame_idx % 50 == 0:
+                import gc
+                gc.collect()
+                # Limit face history size during long processing
+                if len(face_history) > TEMPORAL_SMOOTH_FRAMES:
+                    face_history = face_history[-TEMPORAL_SMOOTH_FRAMES:]
+
+        _queue_put(output_queue, None, stop)
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise errors[0]
+        if encoder is None:
+            raise RuntimeError("No frames could be read from the video")
         update_job_progress(job_id, 99, "encoding")
-        
-        # Enhanced video encoding settings based on quality mode
-        if req.quality_mode == "best":
-            crf_value = "18"  # Higher quality
-            preset = "slow"
-        elif req.quality_mode == "fast":
-            crf_value = "28"  # Lower quality, faster
-            preset = "veryfast"
-        else:  # balanced
-            crf_value = "23"
-            preset = "fast"
-        
-        subprocess.run([
-            "ffmpeg", "-y", "-framerate", str(fps), "-i", str(frames_dir / "frame_%08d.png"),
-            "-i", str(video_path), "-map", "0:v", "-map", "1:a?", "-c:v", "libx264",
-            "-pix_fmt", "yuv420p", "-preset", preset, "-crf", crf_value, "-c:a", "aac", "-shortest",
-            str(out_video_path)
-        ], check=True, capture_output=True)
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            encoder_log.seek(0)
+            raise RuntimeError(f"FFmpeg encoding failed: {encoder_log.read().decode(errors='replace').strip()}")
 
         update_job_progress(job_id, 100, "completed", {
             "output_path": str(out_video_path),
             "quality_mode": req.quality_mode,
+            "encoder": codec_args[1],
             "enhancements_used": {
                 "hd_detection": req.use_hd_detection,
                 "enhancement": req.enhance,
@@ -1177,9 +1944,16 @@ def _do_swap(job_id: str, req: SwapRequest):
         traceback.print_exc()
         update_job_progress(job_id, 0, "failed", {"error": str(e)})
     finally:
-        if frames_dir:
-            import shutil
-            shutil.rmtree(frames_dir, ignore_errors=True)
+        stop.set()
+        # Kill a still-running encoder first so a writer blocked on its stdin unblocks
+        if encoder is not None and encoder.poll() is None:
+            encoder.kill()
+            encoder.wait()
+        for worker in workers:
+            worker.join()
+        if cap is not None:
+            cap.release()
+        encoder_log.close()
 
 class TrackObjectRequest(BaseModel):
     video_path: str
@@ -1411,6 +2185,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Enhanced Face Morphing Service")
     parser.add_argument("--host", default="0.0.0.0", help="Host to bind to")
     parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)), help="Port to bind to")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("MORPH_WORKERS", 1)),
+                        help="Worker processes (each loads its own models; job progress is per process)")
     args = parser.parse_args()
     
     print(f"🚀 Starting Enhanced Face Morphing Service on {args.host}:{args.port}")
@@ -1419,4 +2195,8 @@ if __name__ == "__main__":
     cuda_status = "Enabled" if torch and torch.cuda.is_available() else "Disabled"
     print(f"🔥 GPU Acceleration: {cuda_status}")
     
-    uvicorn.run(app, host=args.host, port=args.port)
+    if args.workers > 1:
+        print(f"⚠️  {args.workers} workers: /progress only sees jobs started on the same process, use a sticky proxy")
+    # loop/http "auto" pick uvloop and httptools when installed (uvicorn[standard]), else asyncio/h11 (e.g. Windows)
+    uvicorn.run("main:app" if args.workers > 1 else app, host=args.host, port=args.port,
+                workers=args.workers, loop="auto", http="auto")